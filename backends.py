@@ -0,0 +1,251 @@
+"""Бэкенды генерации: Gemini и локальная заглушка для нагрузочных тестов без сети
+
+Бэкенд реализует асинхронные методы:
+    generate(prompt, generation_config, on_chunk=None, system_instruction=None) -> BackendResponse
+    count_tokens(text) -> int
+    warm_up(system_instruction=None, probe=True) - подготовка клиента и соединения до первого запроса
+Если передан on_chunk, ответ читается потоком и фрагменты передаются в него по мере поступления.
+system_instruction - неизменные правила шаблона, которые передаются модели отдельно от промпта.
+"""
+import sys
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import datetime
+
+from optimizer_core import MODEL_NAME, estimate_tokens
+
+
+class BackendResponse:
+    """Ответ бэкенда: текст и число токенов запроса и ответа, если они известны"""
+
+    def __init__(self, text, prompt_tokens=None, output_tokens=None):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+
+
+class GeminiBackend:
+    """Google Gemini через google-generativeai
+
+    Для каждой системной инструкции создается и переиспользуется своя модель.
+    При context_cache=True инструкция сохраняется в кэше контекста Gemini на cache_ttl
+    секунд, и запросы ссылаются на него. Если модель не поддерживает кэш или инструкция
+    короче минимального размера кэша, используется обычная системная инструкция.
+    """
+    name = 'gemini'
+
+    def __init__(self, api_key, model_name=MODEL_NAME, context_cache=False, cache_ttl=3600):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.context_cache = context_cache
+        self.cache_ttl = cache_ttl
+        self._genai = None
+        self._model = None
+        # Модели по системной инструкции: пара (модель, момент истечения кэша контекста или None)
+        self._instruction_models = {}
+        self._cache_unavailable = set()
+        self._models_lock = asyncio.Lock()
+
+    def _client(self):
+        """SDK настраивается при первом обращении"""
+        if self._genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+            self._genai = genai
+        return self._genai
+
+    @property
+    def model(self):
+        """Модель без системной инструкции, создается при первом запросе и переиспользуется"""
+        if self._model is None:
+            self._model = self._client().GenerativeModel(self.model_name)
+        return self._model
+
+    async def _model_for(self, system_instruction):
+        if not system_instruction:
+            return self.model
+        entry = self._instruction_models.get(system_instruction)
+        if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+            return entry[0]
+        # Одновременные первые запросы не должны создавать несколько кэшей одной инструкции
+        async with self._models_lock:
+            entry = self._instruction_models.get(system_instruction)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                return entry[0]
+            model, expires = None, None
+            if self.context_cache and system_instruction not in self._cache_unavailable:
+                try:
+                    model = await asyncio.to_thread(self._cached_model, system_instruction)
+                    # Кэш пересоздается немного раньше срока, чтобы запрос не попал на истекший
+                    expires = time.monotonic() + self.cache_ttl * 0.9
+                except Exception as e:
+                    print(f"Context caching unavailable, using system instruction: {e}", file=sys.stderr)
+                    self._cache_unavailable.add(system_instruction)
+            if model is None:
+                model = self._client().GenerativeModel(self.model_name, system_instruction=system_instruction)
+            self._instruction_models[system_instruction] = (model, expires)
+            return model
+
+    def _cached_model(self, system_instruction):
+        genai = self._client()
+        model_name = self.model_name if self.model_name.startswith('models/') else f"models/{self.model_name}"
+        cached = genai.caching.CachedContent.create(
+            model=model_name,
+            system_instruction=system_instruction,
+            ttl=datetime.timedelta(seconds=self.cache_ttl)
+        )
+        return genai.GenerativeModel.from_cached_content(cached_content=cached)
+
+    async def generate(self, prompt, generation_config, on_chunk=None, system_instruction=None):
+        model = await self._model_for(system_instruction)
+        response = await model.generate_content_async(
+            prompt,
+            generation_config=generation_config,
+            stream=on_chunk is not None
+        )
+        if on_chunk is not None:
+            parts = []
+            async for part in response:
+                try:
+                    text = part.text
+                except ValueError:
+                    # Фрагмент без текста (например, только метаданные)
+                    continue
+                if text:
+                    parts.append(text)
+                    on_chunk(text)
+            text = "".join(parts)
+        else:
+            text = response.text
+        usage = getattr(response, 'usage_metadata', None)
+        return BackendResponse(
+            text,
+            getattr(usage, 'prompt_token_count', None),
+            getattr(usage, 'candidates_token_count', None)
+        )
+
+    async def count_tokens(self, text):
+        response = await self.model.count_tokens_async(text)
+        return response.total_tokens
+
+    async def warm_up(self, system_instruction=None, probe=True):
+        """Настраивает SDK, создает модель и при probe открывает соединение пробным count_tokens
+
+        count_tokens идет через тот же асинхронный клиент, что и генерация, поэтому после
+        него первый настоящий запрос не тратит время на DNS, TLS и установку канала.
+        """
+        await asyncio.to_thread(self._client)
+        model = await self._model_for(system_instruction)
+        if probe:
+            await model.count_tokens_async('ping')
+
+
+class StubAPIError(Exception):
+    """Ошибка, имитирующая ответ API с HTTP-статусом code"""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class StubBackend:
+    """Локальная заглушка Gemini с настраиваемыми задержками, темпом потока и ошибками
+
+    Задержки распределены логнормально вокруг медианы, seed делает прогон воспроизводимым.
+    По умолчанию ответ - исходный промпт из запроса с заголовком, как у настоящей модели.
+    connect_latency имитирует установку соединения: ее платит первый запрос, а при idle_timeout -
+    и первый запрос после простоя дольше idle_timeout секунд.
+    """
+    name = 'stub'
+
+    def __init__(self, latency_median=0.8, latency_sigma=0.4, first_token_median=0.3,
+                 chunk_size=40, chunk_interval=0.02, error_rate_429=0.0, error_rate_5xx=0.0,
+                 retry_after=1.0, seed=None, model_name='stub', connect_latency=0.0, idle_timeout=None):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.first_token_median = first_token_median
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_interval
+        self.error_rate_429 = error_rate_429
+        self.error_rate_5xx = error_rate_5xx
+        self.retry_after = retry_after
+        self.model_name = model_name
+        self.connect_latency = connect_latency
+        self.idle_timeout = idle_timeout
+        self.request_count = 0
+        self._random = random.Random(seed)
+        self._last_used = None
+
+    def _sample(self, median):
+        if median <= 0:
+            return 0.0
+        return self._random.lognormvariate(math.log(median), self.latency_sigma)
+
+    def _maybe_fail(self):
+        roll = self._random.random()
+        if roll < self.error_rate_429:
+            raise StubAPIError(429, f"Resource has been exhausted (stub). Please retry in {self.retry_after}s")
+        if roll < self.error_rate_429 + self.error_rate_5xx:
+            raise StubAPIError(503, "The service is currently unavailable (stub)")
+
+    async def _connect(self):
+        now = time.monotonic()
+        if self._last_used is None or (self.idle_timeout is not None and now - self._last_used > self.idle_timeout):
+            await asyncio.sleep(self.connect_latency)
+        self._last_used = time.monotonic()
+
+    def respond(self, prompt):
+        """Детерминированный ответ: текст после последнего маркера промпта"""
+        marker, label = max((prompt.rfind(label), label) for label in ("ПРОМПТ:\n", "PROMPT:\n", "ПРОМПТА:\n", "FRAGMENT:\n"))
+        body = prompt[marker + len(label):] if marker != -1 else prompt
+        return "Улучшенный промпт:\n" + body.strip()
+
+    async def generate(self, prompt, generation_config, on_chunk=None, system_instruction=None):
+        self.request_count += 1
+        await self._connect()
+        # Ошибки приходят после части задержки, как от настоящего сервера
+        await asyncio.sleep(self._sample(self.first_token_median))
+        self._maybe_fail()
+        text = self.respond(prompt)
+        if on_chunk is None:
+            await asyncio.sleep(max(0.0, self._sample(self.latency_median) - self.first_token_median))
+        else:
+            for start in range(0, len(text), self.chunk_size):
+                if start:
+                    await asyncio.sleep(self.chunk_interval)
+                on_chunk(text[start:start + self.chunk_size])
+        prompt_tokens = estimate_tokens(prompt) + (estimate_tokens(system_instruction) if system_instruction else 0)
+        return BackendResponse(text, prompt_tokens, estimate_tokens(text))
+
+    async def count_tokens(self, text):
+        return estimate_tokens(text)
+
+    async def warm_up(self, system_instruction=None, probe=True):
+        if probe:
+            await self._connect()
+
+
+BACKENDS = {
+    'gemini': GeminiBackend,
+    'stub': StubBackend,
+}
+
+
+def create_backend(name='gemini', api_key=None, **options):
+    """Создает бэкенд по имени; options передаются конструктору"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name}")
+    if name == 'gemini':
+        return GeminiBackend(api_key, **options)
+    return BACKENDS[name](**options)
+
+
+def backend_from_env(api_key):
+    """Бэкенд из PROMPT_OPTIMIZER_BACKEND и параметров в PROMPT_OPTIMIZER_BACKEND_OPTIONS (JSON)"""
+    name = os.environ.get('PROMPT_OPTIMIZER_BACKEND', 'gemini')
+    options = json.loads(os.environ.get('PROMPT_OPTIMIZER_BACKEND_OPTIONS') or '{}')
+    return create_backend(name, api_key, **options)
@@ -0,0 +1,379 @@
+"""Консольный пакетный режим: улучшение промптов из JSONL без графического интерфейса
+
+Запуск:
+    python prompt_improver.py batch in.jsonl out.jsonl [--concurrency N] [--unordered]
+
+Каждая строка входного файла - JSON-объект вида {"id": ..., "prompt": "..."}
+или просто JSON-строка с промптом. Для каждой строки в выходной файл пишется
+объект {"id": ..., "result": "..."} или {"id": ..., "error": "..."}.
+
+С --durable задание хранится в очереди jobs.db в папке конфига: повторный запуск
+той же команды продолжает его с места остановки.
+"""
+import os
+import sys
+import json
+import hashlib
+import asyncio
+import argparse
+
+from optimizer_core import get_config_dir, load_stored_api_key, clean_response, SIMILAR_MODES
+from optimizer_engine import PromptOptimizer
+from backends import BACKENDS, create_backend
+from response_cache import ResponseCache
+from metrics import MetricsRecorder
+from history import HistoryStore
+from templates import get_template, load_templates, list_templates
+from job_queue import JobQueue, DEFAULT_MAX_ATTEMPTS, FAILED
+from rate_limit import classify_error
+
+# Сколько промптов подряд может завершиться временной ошибкой, прежде чем запуск остановится
+MAX_CONSECUTIVE_ERRORS = 20
+
+
+def read_prompts(stream):
+    """Читает промпты построчно, не загружая весь файл в память"""
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            # Строка не JSON - считаем ее самим промптом
+            item = line
+        if isinstance(item, dict):
+            yield item.get('id', line_number), str(item.get('prompt') or '')
+        else:
+            yield line_number, str(item)
+
+
+async def run_batch(items, write, optimizer, concurrency=4, ordered=True, use_cache=True,
+                    split_long=False):
+    """Обрабатывает поток промптов с ограниченным числом параллельных запросов
+
+    В упорядоченном режиме результаты пишутся в порядке входа, иначе - по мере готовности.
+    Возвращает пару (успешно, с ошибкой).
+    """
+    done_count = 0
+    failed_count = 0
+    ids = {}
+
+    def prompts():
+        for index, (item_id, prompt) in enumerate(items):
+            ids[index] = item_id
+            yield prompt.strip()
+
+    async for index, result in optimizer.iter_improve(prompts(), concurrency=concurrency, use_cache=use_cache,
+                                                      split_long=split_long, ordered=ordered):
+        item_id = ids.pop(index)
+        if isinstance(result, Exception):
+            failed_count += 1
+            write({'id': item_id, 'error': str(result)})
+        else:
+            done_count += 1
+            write({'id': item_id, 'result': clean_response(result.text)})
+    return done_count, failed_count
+
+
+async def run_durable_batch(queue, job, optimizer, concurrency=4, use_cache=True, split_long=False,
+                            max_attempts=DEFAULT_MAX_ATTEMPTS, max_consecutive_errors=MAX_CONSECUTIVE_ERRORS):
+    """Обрабатывает задание из очереди, сохраняя каждый результат сразу после ответа
+
+    Ошибки квоты не расходуют попытки промпта, остальные повторяемые ошибки - расходуют,
+    неисправимые сразу переносят промпт в список недоставленных. Если подряд идет
+    max_consecutive_errors временных ошибок (квота исчерпана, сеть недоступна), новые
+    промпты не берутся: задание остается в очереди до следующего запуска.
+    Возвращает тройку (успешно, недоставлено, остановлен ли запуск).
+    """
+    done_count = 0
+    failed_count = 0
+    consecutive_errors = 0
+    stopped = False
+    rows = {}
+
+    def prompts():
+        # iter_improve читает промпты лениво, поэтому промпт берется в работу, только когда для него
+        # освободилось место: после сбоя в состоянии in_flight остаются лишь действительно отправленные
+        while not stopped:
+            claimed = queue.claim(job, 1)
+            if not claimed:
+                return
+            row_id, prompt = claimed[0]
+            rows[len(rows)] = row_id
+            yield prompt.strip()
+
+    # Промпты, оставшиеся в работе после прерванного запуска, сразу возвращаются в ожидание и идут в этом запуске
+    queue.recover(job)
+    # После повторяемой ошибки промпт снова в ожидании, и prompts() берет его, как только освободится место;
+    # новый проход нужен, только если ошибка пришла, когда ожидающих промптов уже не оставалось
+    while not stopped and queue.counts(job)['pending']:
+        rows.clear()
+        async for index, result in optimizer.iter_improve(prompts(), concurrency=concurrency, use_cache=use_cache,
+                                                          split_long=split_long):
+            row_id = rows[index]
+            if not isinstance(result, Exception):
+                consecutive_errors = 0
+                done_count += 1
+                queue.complete(row_id, clean_response(result.text), result.prompt_tokens, result.output_tokens)
+                continue
+            kind = classify_error(result)
+            state = queue.fail(row_id, str(result), max_attempts, retryable=kind is not None,
+                               charge=kind != 'throttle')
+            if state == FAILED:
+                failed_count += 1
+            if kind is None:
+                continue
+            consecutive_errors += 1
+            if consecutive_errors >= max_consecutive_errors and not stopped:
+                print(f"Stopping after {consecutive_errors} consecutive errors, last: {result}", file=sys.stderr)
+                stopped = True
+    queue.recover(job)
+    return done_count, failed_count, stopped
+
+
+def write_job_results(queue, job, write):
+    """Пишет результаты задания в порядке входа; недоставленные - с текстом ошибки"""
+    for item_id, state, result, error in queue.results(job):
+        if state == FAILED:
+            write({'id': item_id, 'error': error})
+        else:
+            write({'id': item_id, 'result': result})
+
+
+def job_name(path):
+    """Имя задания по умолчанию - по абсолютному пути входного файла"""
+    return hashlib.sha256(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='prompt_improver.py batch',
+        description='Пакетное улучшение промптов из JSONL-файла'
+    )
+    parser.add_argument('input', help='Входной JSONL-файл или "-" для stdin')
+    parser.add_argument('output', help='Выходной JSONL-файл или "-" для stdout')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Число одновременных запросов к API (по умолчанию 4)')
+    parser.add_argument('--unordered', action='store_true',
+                        help='Писать результаты по мере готовности, а не в порядке входа')
+    parser.add_argument('--split-long', action='store_true',
+                        help='Улучшать очень длинные промпты по разделам параллельно')
+    parser.add_argument('--durable', action='store_true',
+                        help='Хранить задание в очереди jobs.db: повторный запуск продолжает его с места остановки')
+    parser.add_argument('--job', default=None,
+                        help='Имя задания в очереди (по умолчанию - по пути входного файла)')
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help=f'Попыток на промпт до переноса в список недоставленных (по умолчанию {DEFAULT_MAX_ATTEMPTS})')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Вернуть недоставленные промпты задания в очередь')
+    add_optimizer_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_optimizer_arguments(parser):
+    """Общие параметры оптимизатора для пакетного режима и HTTP-сервера"""
+    parser.add_argument('--api-key', default=None,
+                        help='API ключ; по умолчанию GEMINI_API_KEY, GOOGLE_API_KEY или сохраненный ключ')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Не использовать сохраненные ответы')
+    parser.add_argument('--rpm', type=int, default=None,
+                        help='Квота запросов в минуту (по умолчанию без ограничения)')
+    parser.add_argument('--tpm', type=int, default=None,
+                        help='Квота токенов в минуту (по умолчанию без ограничения)')
+    parser.add_argument('--max-retries', type=int, default=5,
+                        help='Число повторов при ошибках 429 и 5xx (по умолчанию 5)')
+    parser.add_argument('--history', action='store_true',
+                        help='Сохранять результаты в историю приложения и брать из нее готовые ответы')
+    parser.add_argument('--similar-threshold', type=float, default=None,
+                        help='Искать в истории почти такие же промпты со сходством от 0 до 1, например 0.9')
+    parser.add_argument('--similar-mode', choices=SIMILAR_MODES, default='reuse',
+                        help='reuse - взять прежний результат, baseline - улучшить на его основе')
+    parser.add_argument('--hedge-after', type=parse_hedge_after, default=None,
+                        help='Дублировать запрос, если ответа нет дольше N секунд или перцентиля задержек, например p95')
+    parser.add_argument('--hedge-model', default=None,
+                        help='Модель для дубликата, например облегченная flash-модель (по умолчанию та же)')
+    parser.add_argument('--preprocess', action='store_true',
+                        help='Сжимать промпты перед отправкой: пробелы, повторы, вынос больших вставок JSON/CSV/base64')
+    parser.add_argument('--template', default='improve',
+                        help='Шаблон из реестра: имя или имя@версия; свои шаблоны - JSON в папке templates конфига')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='gemini',
+                        help='Бэкенд генерации; stub - локальная заглушка для тестов без сети')
+    parser.add_argument('--backend-options', default='{}',
+                        help='Параметры бэкенда в JSON, например {"latency_median": 0.5, "error_rate_429": 0.05}')
+
+
+def parse_hedge_after(value):
+    """Число секунд или перцентиль вида p95"""
+    try:
+        if value.startswith('p') and 0 < float(value[1:]) < 100:
+            return value
+        return float(value)
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"expected seconds or a percentile like p95, got {value!r}")
+
+
+def resolve_api_key(explicit_key):
+    """Ключ из аргумента, переменных окружения или сохраненного конфига"""
+    if explicit_key:
+        return explicit_key
+    for name in ('GEMINI_API_KEY', 'GOOGLE_API_KEY'):
+        if os.environ.get(name):
+            return os.environ[name]
+    return load_stored_api_key(os.path.join(get_config_dir(), 'config.json'))
+
+
+def create_optimizer(args):
+    """Оптимизатор по параметрам командной строки
+
+    Возвращает пару (оптимизатор, история) или (None, None), если ключ или SDK недоступны.
+    """
+    api_key = None
+    if args.backend == 'gemini':
+        api_key = resolve_api_key(args.api_key)
+        if not api_key:
+            print("Error: API key not found. Use --api-key or set GEMINI_API_KEY", file=sys.stderr)
+            return None, None
+        try:
+            import google.generativeai  # noqa: F401
+        except ImportError:
+            print("Please install required package: pip install google-generativeai", file=sys.stderr)
+            return None, None
+    load_templates(os.path.join(get_config_dir(), 'templates'))
+    try:
+        template = get_template(args.template)
+    except ValueError as e:
+        available = ', '.join(template.key for template in list_templates())
+        print(f"Error: {e}; available templates: {available}", file=sys.stderr)
+        return None, None
+    backend_options = json.loads(args.backend_options)
+    backend = create_backend(args.backend, api_key, **backend_options)
+    hedge_backend = None
+    if args.hedge_model:
+        hedge_backend = create_backend(args.backend, api_key, **dict(backend_options, model_name=args.hedge_model))
+    cache = ResponseCache(os.path.join(get_config_dir(), 'cache'))
+    metrics = MetricsRecorder(get_config_dir())
+    # Похожие промпты ищутся в истории, поэтому порог сходства подключает и ее
+    use_history = args.history or args.similar_threshold is not None
+    history = HistoryStore(os.path.join(get_config_dir(), 'history.db')) if use_history else None
+    optimizer = PromptOptimizer(api_key, backend=backend, cache=cache, concurrency=args.concurrency,
+                                rpm=args.rpm, tpm=args.tpm, max_retries=args.max_retries, metrics=metrics,
+                                history=history, similar_threshold=args.similar_threshold,
+                                similar_mode=args.similar_mode, hedge_after=args.hedge_after,
+                                hedge_backend=hedge_backend, template=template, preprocess=args.preprocess)
+    return optimizer, history
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.durable and args.input == '-':
+        print("Error: --durable needs an input file, not stdin", file=sys.stderr)
+        return 2
+    optimizer, history = create_optimizer(args)
+    if optimizer is None:
+        return 2
+    if args.durable:
+        try:
+            return run_durable_main(args, optimizer)
+        finally:
+            if history is not None:
+                history.close()
+
+    source = sys.stdin if args.input == '-' else open(args.input, 'r', encoding='utf-8')
+    target = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        def write(record):
+            target.write(json.dumps(record, ensure_ascii=False) + '\n')
+            target.flush()
+
+        done_count, failed_count = asyncio.run(run_batch(
+            read_prompts(source), write, optimizer,
+            concurrency=args.concurrency,
+            ordered=not args.unordered,
+            use_cache=not args.no_cache,
+            split_long=args.split_long
+        ))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+        if history is not None:
+            history.close()
+
+    print_summary(optimizer, done_count, failed_count)
+    return 1 if failed_count else 0
+
+
+def print_summary(optimizer, done_count, failed_count):
+    print(f"Done: {done_count} optimized, {failed_count} failed, "
+          f"{optimizer.retry_count} retries ({optimizer.throttle_count} throttled), "
+          f"{optimizer.hedge_count} hedges ({optimizer.hedge_wins} won)", file=sys.stderr)
+    if optimizer.preprocess and optimizer.metrics is not None:
+        print(f"Pre-processing saved ~{optimizer.metrics.counters['tokens_saved']} prompt tokens", file=sys.stderr)
+    total = optimizer.metrics.summary()['total_time']
+    if total['p50'] is not None:
+        print(f"Latency p50 {total['p50']:.2f}s, p95 {total['p95']:.2f}s", file=sys.stderr)
+
+
+def run_durable_main(args, optimizer):
+    """Пакетный запуск через постоянную очередь; выходной файл пишется, когда задание завершено"""
+    queue = JobQueue(os.path.join(get_config_dir(), 'jobs.db'))
+    try:
+        name = args.job or job_name(args.input)
+        fingerprint = file_fingerprint(args.input)
+        job = queue.get_job(name)
+        if job is None or not job['enqueued']:
+            with open(args.input, 'r', encoding='utf-8') as source:
+                queue.create_job(name, ((item_id, prompt.strip()) for item_id, prompt in read_prompts(source)),
+                                 source=os.path.abspath(args.input), fingerprint=fingerprint)
+        elif job['fingerprint'] != fingerprint:
+            print(f"Error: {args.input} changed since job {name} was created; "
+                  f"use another --job name to start over", file=sys.stderr)
+            return 2
+        if args.retry_failed:
+            print(f"Requeued {queue.requeue_failed(name)} failed prompts", file=sys.stderr)
+        counts = queue.counts(name)
+        print(f"Job {name}: {counts['done']} done, {counts['pending'] + counts['in_flight']} to go, "
+              f"{counts['failed']} failed", file=sys.stderr)
+
+        done_count, failed_count, stopped = asyncio.run(run_durable_batch(
+            queue, name, optimizer,
+            concurrency=args.concurrency,
+            use_cache=not args.no_cache,
+            split_long=args.split_long,
+            max_attempts=args.max_attempts
+        ))
+        print_summary(optimizer, done_count, failed_count)
+        counts = queue.counts(name)
+        if counts['pending']:
+            print(f"Job {name} paused with {counts['pending']} prompts left; run the same command to resume",
+                  file=sys.stderr)
+            return 3
+
+        target = sys.stdout if args.output == '-' else open(args.output + '.tmp', 'w', encoding='utf-8')
+        try:
+            write_job_results(queue, name,
+                              lambda record: target.write(json.dumps(record, ensure_ascii=False) + '\n'))
+        finally:
+            if target is not sys.stdout:
+                target.close()
+        if target is not sys.stdout:
+            os.replace(args.output + '.tmp', args.output)
+        if counts['failed']:
+            print(f"{counts['failed']} prompts failed permanently; see errors in the output "
+                  f"or requeue them with --retry-failed", file=sys.stderr)
+            return 1
+        return 0
+    finally:
+        queue.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
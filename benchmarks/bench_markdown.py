@@ -0,0 +1,108 @@
+"""Микробенчмарк рендеринга Markdown: прежняя функция против потокового рендерера
+
+Запуск:
+    python benchmarks/bench_markdown.py [--lines 1000 5000 20000] [--repeat 5]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from markdown_render import MarkdownRenderer, render_markdown  # noqa: E402
+from optimizer_core import strip_response_prefixes  # noqa: E402
+
+
+def legacy_format_markdown_to_html(text):
+    """Прежняя реализация PromptImprover.format_markdown_to_html, для сравнения"""
+    import re
+    text = re.sub(r'\*\*(.+?)\*\*', r'<b>\1</b>', text)
+    lines = text.splitlines()
+    cleaned_lines = []
+    for line in lines:
+        line = line.strip()
+        line = re.sub(r'^\*\s*', '', line)
+        if line:
+            cleaned_lines.append(line)
+    result = []
+    for line in cleaned_lines:
+        if line:
+            result.append(f"<p>{line}</p>")
+        else:
+            result.append("<br>")
+    return "\n".join(result)
+
+
+def legacy_clean(text):
+    """Прежняя очистка заголовков из on_generation_finished"""
+    for prefix in ["Улучшенный промпт:", "Улучшенная версия:", "Результат:", "Ответ:"]:
+        text = text.replace(prefix, "").strip()
+    return text
+
+
+def make_document(line_count):
+    """Смешанный документ: заголовки, списки, абзацы и блоки кода"""
+    block = [
+        "## Раздел с правилами",
+        "Вступительный абзац с **жирным** текстом и `кодом`.",
+        "Продолжение абзаца с *курсивом*.",
+        "",
+        "1. Первое правило с **акцентом**",
+        "2. Второе правило",
+        "* маркированный пункт",
+        "* еще один пункт",
+        "",
+        "```",
+        "def example(): return 1",
+        "```",
+        "",
+    ]
+    lines = []
+    while len(lines) < line_count:
+        lines.extend(block)
+    return "\n".join(lines[:line_count])
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def streamed(text, chunk_size=40):
+    renderer = MarkdownRenderer(line_filter=strip_response_prefixes)
+    parts = [renderer.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size)]
+    parts.append(renderer.close())
+    return "".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Микробенчмарк рендеринга Markdown')
+    parser.add_argument('--lines', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    report = []
+    for line_count in args.lines:
+        text = make_document(line_count)
+        legacy = best_of(args.repeat, lambda: legacy_format_markdown_to_html(legacy_clean(text)))
+        single_pass = best_of(args.repeat, lambda: render_markdown(text, strip_response_prefixes))
+        incremental = best_of(args.repeat, lambda: streamed(text))
+        report.append({
+            'lines': line_count,
+            'bytes': len(text.encode('utf-8')),
+            'legacy_s': legacy,
+            'single_pass_s': single_pass,
+            'streamed_s': incremental,
+            'streamed_us_per_line': incremental / line_count * 1e6,
+        })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
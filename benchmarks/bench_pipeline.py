@@ -0,0 +1,327 @@
+"""Бенчмарк всего конвейера оптимизации на фиксированном наборе промптов
+
+Каждый промпт проходит путь окна приложения целиком: шаблон запроса, генерация
+на детерминированной заглушке, потоковый рендеринг фрагментов и итоговая очистка
+с разметкой (build_result_html). Заглушка по умолчанию отвечает без задержек,
+поэтому замеры показывают стоимость собственного кода, а не сети.
+
+Замеры:
+    - время запуска: импорт модулей конвейера и первый результат в отдельном процессе;
+    - задержка одного промпта (p50/p95/p99) по всему набору и по каждой группе;
+    - пропускная способность при параллельной обработке;
+    задержки и пропускная способность берутся лучшими из --rounds повторов, как в bench_markdown;
+    - пик памяти (tracemalloc) за отдельный проход, чтобы трассировка не искажала время.
+
+Запуск:
+    python benchmarks/bench_pipeline.py --output results.json
+    python benchmarks/bench_pipeline.py --baseline results.json --tolerance 0.25
+
+С --baseline результаты сравниваются с сохраненными: ухудшение любой метрики
+больше допуска дает код 1, несравнимые прогоны (другой набор или параметры) - код 2.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import gc
+import platform
+import statistics
+import subprocess
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from backends import StubBackend  # noqa: E402
+from markdown_render import MarkdownRenderer, build_result_html, LARGE_DOCUMENT_CHARS  # noqa: E402
+from metrics import percentile  # noqa: E402
+from optimizer_core import strip_response_prefixes  # noqa: E402
+from optimizer_engine import PromptOptimizer  # noqa: E402
+
+# Версия формата результатов: при несовпадении сравнение с базовой линией не выполняется
+RESULTS_VERSION = 1
+# Изменения меньше порога считаются шумом: доли миллисекунды на коротких промптах скачут между прогонами
+NOISE_FLOOR = {'latency_ms': 1.0, 'startup_s': 0.02, 'peak_memory_mb': 0.5}
+
+SHORT_RU = [
+    "Напиши пост про кофе",
+    "Составь план тренировок на неделю для новичка",
+    "Объясни, что такое рекурсия, простыми словами",
+    "Придумай пять названий для пекарни",
+    "Напиши письмо клиенту с извинениями за задержку заказа",
+    "Сделай краткий пересказ статьи о климате",
+    "Переведи текст на английский и сохрани деловой тон",
+    "Подготовь вопросы для собеседования python-разработчика",
+]
+
+_EN_PARAGRAPHS = [
+    "You are helping a product team write release notes for a mobile banking application. "
+    "The audience is existing customers who are not technical, so avoid jargon and explain "
+    "every change in terms of what the user can now do.",
+    "Group the changes by area: payments, cards, security and accessibility. For each change "
+    "give a one-sentence summary followed by a short paragraph with details and, where it "
+    "helps, a concrete example of the new behaviour.",
+    "Keep the tone friendly but precise. Do not promise features that are still in testing, "
+    "and mention known issues in a separate section at the end with workarounds if any exist.",
+    "The notes will be shown inside the app on small screens, so keep paragraphs short, use "
+    "lists where possible and limit the whole text to roughly six hundred words.",
+]
+
+_SECTION_TITLES = ["Роль", "Контекст", "Правила", "Формат ответа", "Примеры", "Ограничения"]
+_SECTION_LINES = [
+    "Ты - ассистент службы поддержки интернет-магазина электроники.",
+    "Отвечай на вопросы о заказах, доставке, возвратах и гарантии.",
+    "- Всегда уточняй номер заказа, если вопрос касается конкретной покупки",
+    "- Не раскрывай внутренние данные о поставщиках и наценках",
+    "- Если вопрос вне компетенции, вежливо перенаправь к оператору",
+    "1. Приветствие в одну строку",
+    "2. Ответ по существу с **ключевыми** сроками и суммами",
+    "3. Следующий шаг для клиента",
+    "Пример: клиент спрашивает о статусе заказа `A-1024`, ассистент сообщает дату доставки.",
+]
+
+
+def build_corpus():
+    """Фиксированный набор: группы промптов разного размера и языка, без случайности"""
+    long_en = []
+    for index in range(6):
+        # Размер растет от ~3 до ~13 тысяч символов
+        repeats = 4 + index * 4
+        paragraphs = [f"Part {part + 1}. {_EN_PARAGRAPHS[part % len(_EN_PARAGRAPHS)]}" for part in range(repeats)]
+        long_en.append("\n\n".join(paragraphs))
+    sections = []
+    for index in range(4):
+        # Крупные системные промпты длиннее LONG_PROMPT_TOKENS проходят путь деления на разделы
+        blocks = []
+        for copy in range(3 + index * 3):
+            for title in _SECTION_TITLES:
+                lines = [f"{line} (блок {copy + 1})" for line in _SECTION_LINES]
+                blocks.append(f"## {title} {copy + 1}\n" + "\n".join(lines))
+        sections.append("# Системный промпт поддержки\n\n" + "\n\n".join(blocks))
+    return {'short-ru': SHORT_RU, 'long-en': long_en, 'sections': sections}
+
+
+def corpus_fingerprint(corpus):
+    digest = hashlib.sha256(json.dumps(corpus, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def create_optimizer(args):
+    backend = StubBackend(latency_median=args.latency, first_token_median=args.latency / 4,
+                          chunk_interval=0.0, seed=args.seed)
+    # Без кэша, истории и метрик: каждый прогон выполняет одинаковую работу
+    return PromptOptimizer('benchmark', backend=backend, concurrency=args.concurrency,
+                           preprocess=args.preprocess)
+
+
+async def run_prompt(optimizer, prompt):
+    """Один промпт как в окне приложения; возвращает время до готового HTML в секундах"""
+    start = time.perf_counter()
+    renderer = MarkdownRenderer(line_filter=strip_response_prefixes)
+    rendered = []
+    streamed_chars = 0
+
+    def on_chunk(text):
+        nonlocal streamed_chars
+        streamed_chars += len(text)
+        if streamed_chars <= LARGE_DOCUMENT_CHARS:
+            rendered.append(renderer.feed(text))
+
+    result = await optimizer.improve(prompt, stream=True, on_chunk=on_chunk, use_cache=False, split_long=True)
+    # Движок очищает и размечает ответ целиком, окно дописывает потоковый HTML
+    build_result_html(result.text)
+    rendered.append(renderer.close())
+    return time.perf_counter() - start
+
+
+async def measure_latency(optimizer, corpus, iterations):
+    """Задержки по группам: промпты обрабатываются по одному, без очереди"""
+    latencies = {group: [] for group in corpus}
+    for _ in range(iterations):
+        for group, prompts in corpus.items():
+            for prompt in prompts:
+                latencies[group].append(await run_prompt(optimizer, prompt))
+    return latencies
+
+
+async def measure_throughput(optimizer, corpus, iterations):
+    """Промптов в секунду, когда весь набор отправлен сразу и ограничен concurrency оптимизатора"""
+    prompts = [prompt for _ in range(iterations) for group in corpus.values() for prompt in group]
+    start = time.perf_counter()
+    await asyncio.gather(*(run_prompt(optimizer, prompt) for prompt in prompts))
+    return len(prompts) / (time.perf_counter() - start)
+
+
+async def measure_peak_memory(optimizer, corpus):
+    """Пик памяти за один проход набора, в мегабайтах"""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        await measure_throughput(optimizer, corpus, 1)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+# Код, выполняемый в дочернем процессе; печатает время до первого результата в секундах
+STARTUP_SCRIPT = r'''
+import sys, time, asyncio
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+from backends import StubBackend
+from markdown_render import build_result_html
+from optimizer_engine import PromptOptimizer
+optimizer = PromptOptimizer('benchmark', backend=StubBackend(latency_median=0.0, first_token_median=0.0, seed=0))
+result = asyncio.run(optimizer.improve("Напиши пост про кофе", use_cache=False))
+build_result_html(result.text)
+print(time.perf_counter() - start)
+'''
+
+
+def measure_startup(runs):
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, ROOT_DIR],
+                                capture_output=True, text=True, check=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        'p50': percentile(values, 0.50) * 1000,
+        'p95': percentile(values, 0.95) * 1000,
+        'p99': percentile(values, 0.99) * 1000,
+    }
+
+
+async def measure_pipeline(args, corpus):
+    # Примитивы оптимизатора привязаны к циклу событий, поэтому все этапы идут в одном
+    optimizer = create_optimizer(args)
+    # Прогревочный проход: импорт ленивых модулей и первые вызовы не попадают в замеры
+    await measure_latency(optimizer, corpus, 1)
+    latency_rounds = []
+    throughput_rounds = []
+    for _ in range(args.rounds):
+        # Мусор прошлых повторов не собирается посреди замера
+        gc.collect()
+        latencies = await measure_latency(optimizer, corpus, args.iterations)
+        latency_rounds.append(dict(
+            {'all': summarize([value for values in latencies.values() for value in values])},
+            **{group: summarize(values) for group, values in latencies.items()}
+        ))
+        gc.collect()
+        throughput_rounds.append(await measure_throughput(optimizer, corpus, args.iterations))
+    peak_memory = await measure_peak_memory(optimizer, corpus)
+    # Лучший повтор меньше всего зависит от фоновой нагрузки машины
+    latency = {
+        group: {name: min(round_[group][name] for round_ in latency_rounds) for name in stats}
+        for group, stats in latency_rounds[0].items()
+    }
+    return latency, max(throughput_rounds), peak_memory
+
+
+def run_benchmark(args):
+    corpus = build_corpus()
+    latency, throughput, peak_memory = asyncio.run(measure_pipeline(args, corpus))
+    startup = measure_startup(args.startup_runs)
+    return {
+        'version': RESULTS_VERSION,
+        'params': {
+            'corpus': corpus_fingerprint(corpus),
+            'iterations': args.iterations,
+            'rounds': args.rounds,
+            'concurrency': args.concurrency,
+            'latency': args.latency,
+            'seed': args.seed,
+            'preprocess': args.preprocess,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'prompts': {group: len(prompts) for group, prompts in corpus.items()},
+        'metrics': {
+            'startup_s': startup,
+            'throughput_prompts_per_s': throughput,
+            'peak_memory_mb': peak_memory,
+            'latency_ms': latency,
+        },
+    }
+
+
+def flatten_metrics(metrics, prefix=''):
+    flat = {}
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten_metrics(value, f"{prefix}{name}."))
+        else:
+            flat[f"{prefix}{name}"] = value
+    return flat
+
+
+def compare(report, baseline, tolerance):
+    """Список ухудшений относительно базовой линии; для пропускной способности лучше больше, для прочего - меньше"""
+    current = flatten_metrics(report['metrics'])
+    regressions = []
+    for name, base_value in flatten_metrics(baseline['metrics']).items():
+        value = current.get(name)
+        if value is None or not base_value:
+            continue
+        higher_is_better = name.startswith('throughput')
+        change = (value - base_value) / base_value
+        noise_floor = NOISE_FLOOR.get(name.split('.')[0], 0.0)
+        if (-change if higher_is_better else change) > tolerance and abs(value - base_value) > noise_floor:
+            regressions.append(f"{name}: {base_value:.3f} -> {value:.3f} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк конвейера оптимизации на заглушке')
+    parser.add_argument('--iterations', type=int, default=10,
+                        help='Сколько раз пройти набор за один повтор (по умолчанию 10)')
+    parser.add_argument('--rounds', type=int, default=5, help='Число повторов, берется лучший (по умолчанию 5)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Одновременных запросов при замере пропускной способности (по умолчанию 8)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Медианная задержка заглушки в секундах; 0 - замер только собственного кода')
+    parser.add_argument('--seed', type=int, default=1, help='Seed заглушки (по умолчанию 1)')
+    parser.add_argument('--preprocess', action='store_true', help='Включить локальную подготовку промптов')
+    parser.add_argument('--startup-runs', type=int, default=5, help='Прогонов замера запуска (по умолчанию 5)')
+    parser.add_argument('--output', default=None, help='Сохранить результаты в JSON-файл')
+    parser.add_argument('--baseline', default=None, help='JSON прежнего прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Допустимое ухудшение метрики относительно базовой линии (по умолчанию 0.25)')
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('version') != RESULTS_VERSION or baseline.get('params') != report['params']:
+        print(f"Baseline is not comparable: params {baseline.get('params')} != {report['params']}", file=sys.stderr)
+        return 2
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions:
+        print(f"PERFORMANCE REGRESSION (tolerance {args.tolerance:.0%}):", file=sys.stderr)
+        for line in regressions:
+            print(f"  {line}", file=sys.stderr)
+        return 1
+    print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
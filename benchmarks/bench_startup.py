@@ -0,0 +1,86 @@
+"""Бенчмарк холодного старта: время импорта модуля и время до первой отрисовки окна
+
+Каждый прогон выполняется в отдельном процессе, чтобы кэш импортов не искажал результат.
+
+Запуск:
+    python benchmarks/bench_startup.py [--runs 5] [--max-first-paint 1.5]
+
+Без дисплея можно использовать QT_QPA_PLATFORM=offscreen.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Код, выполняемый в дочернем процессе; печатает замеры в формате JSON
+CHILD_SCRIPT = r'''
+import sys, time, json
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import prompt_improver
+import_time = time.perf_counter() - start
+
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import QTimer
+app = QApplication(sys.argv[:1])
+window = prompt_improver.PromptImprover()
+window.show()
+timings = {'import': import_time, 'window': time.perf_counter() - start}
+
+def on_first_paint():
+    # Первая итерация цикла событий после show() наступает после отрисовки окна
+    timings['first_paint'] = time.perf_counter() - start
+    timings['heavy_modules'] = sorted(
+        name for name in ('google.generativeai', 'cryptography') if name in sys.modules
+    )
+    window.close()
+    app.quit()
+
+QTimer.singleShot(0, on_first_paint)
+app.exec()
+print(json.dumps(timings))
+'''
+
+
+def measure_once():
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD_SCRIPT, ROOT_DIR],
+        capture_output=True, text=True, check=True
+    ).stdout
+    # Приложение пишет отладочный вывод, замеры - последняя строка
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк холодного старта Prompt Optimizer')
+    parser.add_argument('--runs', type=int, default=5, help='Число прогонов (по умолчанию 5)')
+    parser.add_argument('--max-first-paint', type=float, default=None,
+                        help='Порог медианы времени до первой отрисовки в секундах; превышение дает код 1')
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.runs)]
+    report = {
+        key: {
+            'median': statistics.median(run[key] for run in runs),
+            'min': min(run[key] for run in runs),
+            'max': max(run[key] for run in runs),
+        }
+        for key in ('import', 'window', 'first_paint')
+    }
+    report['heavy_modules_at_first_paint'] = runs[-1]['heavy_modules']
+    report['runs'] = args.runs
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    if args.max_first_paint is not None and report['first_paint']['median'] > args.max_first_paint:
+        print(f"First paint regression: {report['first_paint']['median']:.3f}s > {args.max_first_paint:.3f}s",
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""История оптимизаций в SQLite с полнотекстовым поиском
+
+Каждая пара промпт/результат сохраняется вместе с моделью, параметрами генерации,
+задержками и числом токенов. Поиск идет по индексу FTS5, а списки отдаются
+страницами по ключу id, поэтому их скорость не зависит от размера архива.
+Корзины LSH из near_duplicates позволяют найти почти такой же промпт без перебора архива.
+"""
+import sys
+import re
+import json
+import time
+import sqlite3
+import threading
+
+from near_duplicates import shingles, minhash, band_keys, jaccard, indexable, MAX_SHINGLES
+
+# Размер страницы истории по умолчанию
+PAGE_SIZE = 50
+# Длина превью промпта и результата в списках
+PREVIEW_CHARS = 200
+# Сколько кандидатов LSH проверяется точным сходством
+SIMILAR_CANDIDATES = 10
+# Версия корзин LSH (PRAGMA user_version): 2 - сигнатуры длинных промптов по выборке n-грамм
+LSH_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    prompt TEXT NOT NULL,
+    result TEXT NOT NULL,
+    model TEXT,
+    generation_config TEXT,
+    request_key TEXT,
+    template TEXT,
+    first_token_time REAL,
+    total_time REAL,
+    prompt_tokens INTEGER,
+    output_tokens INTEGER
+);
+CREATE INDEX IF NOT EXISTS history_request_key ON history(request_key);
+CREATE TABLE IF NOT EXISTS history_lsh (
+    bucket INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (bucket, id)
+) WITHOUT ROWID;
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+    prompt, result, content='history', content_rowid='id', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts(rowid, prompt, result) VALUES (new.id, new.prompt, new.result);
+END;
+CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN
+    INSERT INTO history_fts(history_fts, rowid, prompt, result) VALUES ('delete', old.id, old.prompt, old.result);
+END;
+"""
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+_LIST_COLUMNS = (f"h.id, h.created, substr(h.prompt, 1, {PREVIEW_CHARS}), "
+                 f"substr(h.result, 1, {PREVIEW_CHARS}), h.model, h.total_time")
+_FULL_COLUMNS = ('id', 'created', 'prompt', 'result', 'model', 'generation_config', 'request_key', 'template',
+                 'first_token_time', 'total_time', 'prompt_tokens', 'output_tokens')
+
+
+def build_match_query(text):
+    """Запрос FTS5 из пользовательского текста: все слова, последнее - как префикс"""
+    words = _WORD_RE.findall(text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    # Поиск работает уже во время набора последнего слова
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class HistoryStore:
+    """Хранилище истории; методы потокобезопасны и могут вызываться из любого потока"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self.fts_available = False
+
+    def _connect(self):
+        """Соединение открывается при первом обращении, чтобы не задерживать запуск"""
+        if self._conn is not None:
+            return self._conn
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # WAL позволяет читать историю, пока фоновый поток дописывает новые записи
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SCHEMA)
+        if 'template' not in {row[1] for row in conn.execute('PRAGMA table_info(history)')}:
+            # Записи старой базы не знают своего шаблона и не находятся поиском похожих с шаблоном
+            conn.execute('ALTER TABLE history ADD COLUMN template TEXT')
+        try:
+            conn.executescript(_FTS_SCHEMA)
+            self.fts_available = True
+        except sqlite3.OperationalError as e:
+            # Сборка SQLite без FTS5: поиск работает через LIKE
+            print(f"FTS5 is not available, falling back to LIKE search: {e}", file=sys.stderr)
+        if conn.execute('PRAGMA user_version').fetchone()[0] < LSH_VERSION:
+            self._migrate_lsh(conn)
+        conn.commit()
+        self._conn = conn
+        return conn
+
+    def _migrate_lsh(self, conn):
+        """Пересчитывает корзины записей, чья сигнатура изменилась с выборкой n-грамм
+
+        У промптов короче MAX_SHINGLES символов n-грамм не больше порога, их корзины прежние.
+        """
+        rows = conn.execute('SELECT id, prompt FROM history WHERE length(prompt) > ?', (MAX_SHINGLES,)).fetchall()
+        for entry_id, prompt in rows:
+            conn.execute('DELETE FROM history_lsh WHERE id = ?', (entry_id,))
+            if indexable(prompt):
+                conn.executemany('INSERT OR IGNORE INTO history_lsh (bucket, id) VALUES (?, ?)',
+                                 [(bucket, entry_id) for bucket in band_keys(minhash(shingles(prompt)))])
+        conn.execute(f'PRAGMA user_version = {LSH_VERSION}')
+
+    def add(self, prompt, result, model=None, generation_config=None, request_key=None, template=None,
+            first_token_time=None, total_time=None, prompt_tokens=None, output_tokens=None):
+        """Сохраняет оптимизацию и возвращает id записи
+
+        template - строка, однозначно определяющая правила шаблона (например, имя@версия и отпечаток).
+        """
+        config_text = json.dumps(generation_config, sort_keys=True) if generation_config is not None else None
+        # Отпечаток считается до блокировки, чтобы не задерживать чтение истории
+        buckets = band_keys(minhash(shingles(prompt))) if indexable(prompt) else []
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(
+                'INSERT INTO history (created, prompt, result, model, generation_config, request_key, template, '
+                'first_token_time, total_time, prompt_tokens, output_tokens) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (time.time(), prompt, result, model, config_text, request_key, template,
+                 first_token_time, total_time, prompt_tokens, output_tokens)
+            )
+            entry_id = cursor.lastrowid
+            conn.executemany('INSERT OR IGNORE INTO history_lsh (bucket, id) VALUES (?, ?)',
+                             [(bucket, entry_id) for bucket in buckets])
+            conn.commit()
+            return entry_id
+
+    def lookup(self, request_key):
+        """Последний результат для того же запроса (промпт, модель, шаблон, параметры) или None"""
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT result FROM history WHERE request_key = ? ORDER BY id DESC LIMIT 1',
+                (request_key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def find_similar(self, prompt, threshold, model=None, generation_config=None, template=None):
+        """Самый похожий ранее оптимизированный промпт: пара (сходство, запись) или None
+
+        Кандидаты берутся из корзин LSH и ранжируются по числу совпавших полос,
+        затем для лучших считается точное сходство Жаккара по n-граммам.
+        model, generation_config и template ограничивают поиск результатами с теми же настройками.
+        """
+        if not indexable(prompt):
+            return None
+        prompt_shingles = shingles(prompt)
+        buckets = band_keys(minhash(prompt_shingles))
+        conditions = []
+        params = list(buckets)
+        if model is not None:
+            conditions.append('h.model = ?')
+            params.append(model)
+        if generation_config is not None:
+            conditions.append('h.generation_config = ?')
+            params.append(json.dumps(generation_config, sort_keys=True))
+        if template is not None:
+            conditions.append('h.template = ?')
+            params.append(template)
+        where = ''.join(f' AND {condition}' for condition in conditions)
+        with self._lock:
+            conn = self._connect()
+            candidates = conn.execute(
+                f"SELECT l.id, count(*) AS bands FROM history_lsh l JOIN history h ON h.id = l.id "
+                f"WHERE l.bucket IN ({', '.join('?' * len(buckets))}){where} "
+                f"GROUP BY l.id ORDER BY bands DESC, l.id DESC LIMIT ?",
+                params + [SIMILAR_CANDIDATES]
+            ).fetchall()
+            if not candidates:
+                return None
+            ids = [entry_id for entry_id, _ in candidates]
+            rows = conn.execute(
+                f"SELECT {', '.join(_FULL_COLUMNS)} FROM history WHERE id IN ({', '.join('?' * len(ids))})",
+                ids
+            ).fetchall()
+        best = None
+        for row in rows:
+            entry = dict(zip(_FULL_COLUMNS, row))
+            similarity = jaccard(prompt_shingles, shingles(entry['prompt']))
+            # При равном сходстве предпочтительнее более свежий результат
+            if similarity >= threshold and (best is None or (similarity, entry['id']) > (best[0], best[1]['id'])):
+                best = (similarity, entry)
+        return best
+
+    def get(self, entry_id):
+        """Полная запись по id в виде словаря или None"""
+        with self._lock:
+            row = self._connect().execute(
+                f"SELECT {', '.join(_FULL_COLUMNS)} FROM history WHERE id = ?", (entry_id,)
+            ).fetchone()
+        return dict(zip(_FULL_COLUMNS, row)) if row else None
+
+    def page(self, query=None, before_id=None, limit=PAGE_SIZE):
+        """Страница записей от новых к старым с превью промпта и результата
+
+        before_id - id последней записи предыдущей страницы; query - строка поиска.
+        Возвращает кортежи (id, created, prompt, result, model, total_time).
+        """
+        conditions = []
+        params = []
+        # Ключ сортировки: при поиске - rowid индекса FTS5, тогда LIMIT обрывает перебор совпадений
+        order_column = 'h.id'
+        with self._lock:
+            conn = self._connect()
+            if query and query.strip():
+                if self.fts_available:
+                    match = build_match_query(query)
+                    if match is None:
+                        return []
+                    source = 'history_fts JOIN history h ON h.id = history_fts.rowid'
+                    order_column = 'history_fts.rowid'
+                    conditions.append('history_fts MATCH ?')
+                    params.append(match)
+                else:
+                    source = 'history h'
+                    conditions.append('(h.prompt LIKE ? OR h.result LIKE ?)')
+                    pattern = f"%{query.strip()}%"
+                    params.extend([pattern, pattern])
+            else:
+                source = 'history h'
+            if before_id is not None:
+                conditions.append(f'{order_column} < ?')
+                params.append(before_id)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            return conn.execute(
+                f"SELECT {_LIST_COLUMNS} FROM {source} {where} ORDER BY {order_column} DESC LIMIT ?",
+                params + [limit]
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,210 @@
+"""Постоянная очередь пакетных заданий в SQLite
+
+Каждый промпт задания хранится со своим состоянием: pending (ждет), in_flight
+(взят в работу), done (готов, результат сохранен) или failed (список недоставленных:
+исчерпаны попытки или ошибка неисправима). Результат записывается сразу после
+ответа, поэтому после сбоя, обрыва сети или исчерпания квоты задание
+продолжается с места остановки: готовые промпты повторно не отправляются,
+а взятые в работу, но не завершенные возвращаются в ожидание.
+"""
+import json
+import time
+import sqlite3
+import threading
+
+PENDING = 'pending'
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+FAILED = 'failed'
+STATES = (PENDING, IN_FLIGHT, DONE, FAILED)
+
+# Сколько попыток дается промпту до переноса в список недоставленных
+DEFAULT_MAX_ATTEMPTS = 3
+# Размер пачки при добавлении и чтении результатов
+CHUNK_SIZE = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    name TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    source TEXT,
+    fingerprint TEXT,
+    enqueued INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    job TEXT NOT NULL,
+    item_id TEXT,
+    prompt TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    updated REAL,
+    prompt_tokens INTEGER,
+    output_tokens INTEGER
+);
+CREATE INDEX IF NOT EXISTS items_job_state ON items(job, state, id);
+"""
+
+
+class JobQueue:
+    """Очередь заданий; методы потокобезопасны, каждое изменение сразу фиксируется"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is not None:
+            return self._conn
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # WAL с synchronous=NORMAL: фиксация без fsync на каждый результат, но без потерь при падении процесса
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SCHEMA)
+        conn.commit()
+        self._conn = conn
+        return conn
+
+    def get_job(self, name):
+        """Задание по имени в виде словаря или None"""
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT name, created, source, fingerprint, enqueued FROM jobs WHERE name = ?', (name,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('name', 'created', 'source', 'fingerprint', 'enqueued'), row))
+
+    def create_job(self, name, items, source=None, fingerprint=None):
+        """Добавляет задание из пар (id, промпт); items читается лениво, пачками
+
+        Задание помечается готовым только после добавления всех промптов, поэтому
+        прерванное добавление при следующем вызове начинается заново.
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute('DELETE FROM items WHERE job = ?', (name,))
+            conn.execute('INSERT OR REPLACE INTO jobs (name, created, source, fingerprint, enqueued) '
+                         'VALUES (?, ?, ?, ?, 0)', (name, time.time(), source, fingerprint))
+            conn.commit()
+        chunk = []
+        for item_id, prompt in items:
+            chunk.append((name, json.dumps(item_id, ensure_ascii=False), prompt))
+            if len(chunk) >= CHUNK_SIZE:
+                self._insert_items(chunk)
+                chunk = []
+        if chunk:
+            self._insert_items(chunk)
+        with self._lock:
+            conn = self._connect()
+            conn.execute('UPDATE jobs SET enqueued = 1 WHERE name = ?', (name,))
+            conn.commit()
+
+    def _insert_items(self, rows):
+        with self._lock:
+            conn = self._connect()
+            conn.executemany('INSERT INTO items (job, item_id, prompt) VALUES (?, ?, ?)', rows)
+            conn.commit()
+
+    def recover(self, name):
+        """Возвращает в ожидание промпты, взятые в работу прерванным запуском; возвращает их число"""
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute('UPDATE items SET state = ?, updated = ? WHERE job = ? AND state = ?',
+                                  (PENDING, time.time(), name, IN_FLIGHT))
+            conn.commit()
+            return cursor.rowcount
+
+    def claim(self, name, limit):
+        """Берет в работу до limit ожидающих промптов: список пар (номер, промпт) в порядке добавления"""
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                'SELECT id, prompt FROM items WHERE job = ? AND state = ? ORDER BY id LIMIT ?',
+                (name, PENDING, limit)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    'UPDATE items SET state = ?, updated = ? WHERE id = ?',
+                    [(IN_FLIGHT, time.time(), row_id) for row_id, _ in rows]
+                )
+                conn.commit()
+            return rows
+
+    def complete(self, row_id, result, prompt_tokens=None, output_tokens=None):
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                'UPDATE items SET state = ?, result = ?, error = NULL, updated = ?, prompt_tokens = ?, '
+                'output_tokens = ? WHERE id = ?',
+                (DONE, result, time.time(), prompt_tokens, output_tokens, row_id)
+            )
+            conn.commit()
+
+    def fail(self, row_id, error, max_attempts=DEFAULT_MAX_ATTEMPTS, retryable=True, charge=True):
+        """Записывает ошибку и возвращает новое состояние промпта
+
+        Неисправимая ошибка сразу переносит промпт в список недоставленных, повторяемая -
+        после max_attempts неудачных попыток. charge=False не засчитывает попытку (например,
+        при исчерпании квоты, когда промпт не виноват).
+        """
+        with self._lock:
+            conn = self._connect()
+            if charge:
+                conn.execute('UPDATE items SET attempts = attempts + 1 WHERE id = ?', (row_id,))
+            attempts = conn.execute('SELECT attempts FROM items WHERE id = ?', (row_id,)).fetchone()[0]
+            state = PENDING if retryable and attempts < max_attempts else FAILED
+            conn.execute('UPDATE items SET state = ?, error = ?, updated = ? WHERE id = ?',
+                         (state, error, time.time(), row_id))
+            conn.commit()
+            return state
+
+    def requeue_failed(self, name):
+        """Возвращает недоставленные промпты в ожидание с новым счетчиком попыток"""
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(
+                'UPDATE items SET state = ?, attempts = 0, updated = ? WHERE job = ? AND state = ?',
+                (PENDING, time.time(), name, FAILED)
+            )
+            conn.commit()
+            return cursor.rowcount
+
+    def counts(self, name):
+        """Число промптов задания по состояниям"""
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT state, count(*) FROM items WHERE job = ? GROUP BY state', (name,)
+            ).fetchall()
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(rows)
+        return counts
+
+    def results(self, name, state=None):
+        """Перебирает записи (id, состояние, результат, ошибка) в порядке добавления
+
+        Записи читаются страницами по ключу, блокировка не удерживается между ними.
+        """
+        last_id = 0
+        condition = ' AND state = ?' if state else ''
+        while True:
+            params = [name, last_id] + ([state] if state else []) + [CHUNK_SIZE]
+            with self._lock:
+                rows = self._connect().execute(
+                    f'SELECT id, item_id, state, result, error FROM items WHERE job = ? AND id > ?{condition} '
+                    f'ORDER BY id LIMIT ?', params
+                ).fetchall()
+            if not rows:
+                return
+            for row_id, item_id, item_state, result, error in rows:
+                yield json.loads(item_id), item_state, result, error
+            last_id = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
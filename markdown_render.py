@@ -0,0 +1,172 @@
+"""Потоковый рендерер Markdown в HTML для окна результата
+
+Текст обрабатывается за один проход и может поступать порциями: каждая
+законченная строка разбирается один раз, а готовые блоки (абзацы, списки,
+заголовки, блоки кода) возвращаются сразу как самостоятельные фрагменты HTML.
+"""
+import re
+from html import escape
+
+from optimizer_core import clean_response
+
+# Результаты длиннее порога показываются простым текстом: разметка мегабайтов HTML замораживает окно
+LARGE_DOCUMENT_CHARS = 500_000
+
+# Регулярные выражения компилируются один раз при импорте модуля
+_FENCE_RE = re.compile(r'^\s*(```|~~~)')
+_HEADING_RE = re.compile(r'^\s*(#{1,6})\s+(.*?)\s*#*\s*$')
+_UNORDERED_RE = re.compile(r'^\s*[-*+]\s+(.*)$')
+_ORDERED_RE = re.compile(r'^\s*(\d{1,9})[.)]\s+(.*)$')
+_RULE_RE = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$')
+_INLINE_RE = re.compile(
+    r'`([^`]+)`'                    # код
+    r'|\*\*(.+?)\*\*|__(.+?)__'     # жирный
+    r'|\*(?![\s*])(.+?)(?<!\s)\*'   # курсив
+)
+
+
+def _inline_replace(match):
+    code, bold, bold_alt, italic = match.groups()
+    if code is not None:
+        return f"<code>{code}</code>"
+    if bold is not None or bold_alt is not None:
+        return f"<b>{_render_inline(bold if bold is not None else bold_alt)}</b>"
+    return f"<i>{_render_inline(italic)}</i>"
+
+
+def _render_inline(text):
+    return _INLINE_RE.sub(_inline_replace, text)
+
+
+def render_inline(text):
+    """Экранирует HTML и применяет строчное форматирование: код, жирный, курсив"""
+    text = escape(text, quote=False)
+    if '*' in text or '`' in text or '_' in text:
+        return _render_inline(text)
+    return text
+
+
+class MarkdownRenderer:
+    """Инкрементальный рендерер: feed() принимает очередную порцию текста,
+    close() завершает открытые блоки. Оба метода возвращают готовый HTML."""
+
+    def __init__(self, line_filter=None):
+        self.line_filter = line_filter
+        self._pending = []       # Незаконченная последняя строка, по частям
+        self._block = None       # 'p', 'ul', 'ol' или 'code'
+        self._block_items = []
+        self._list_start = 1
+
+    def feed(self, text):
+        """Добавляет порцию текста и возвращает HTML законченных блоков"""
+        if '\n' not in text:
+            self._pending.append(text)
+            return ''
+        self._pending.append(text)
+        data = ''.join(self._pending)
+        last_newline = data.rfind('\n')
+        tail = data[last_newline + 1:]
+        self._pending = [tail] if tail else []
+        out = []
+        for line in data[:last_newline].split('\n'):
+            self._process_line(line, out)
+        return ''.join(out)
+
+    def close(self):
+        """Обрабатывает остаток текста и закрывает открытые блоки"""
+        out = []
+        if self._pending:
+            line = ''.join(self._pending)
+            self._pending = []
+            self._process_line(line, out)
+        self._flush(out)
+        return ''.join(out)
+
+    def _flush(self, out):
+        block = self._block
+        if block is None:
+            return
+        items = self._block_items
+        if block == 'p':
+            out.append(f"<p>{'<br>'.join(items)}</p>")
+        elif block == 'code':
+            out.append(f"<pre><code>{escape(chr(10).join(items), quote=False)}</code></pre>")
+        elif block == 'ol' and self._list_start != 1:
+            out.append(f'<ol start="{self._list_start}">' + ''.join(f"<li>{item}</li>" for item in items) + "</ol>")
+        else:
+            out.append(f"<{block}>" + ''.join(f"<li>{item}</li>" for item in items) + f"</{block}>")
+        self._block = None
+        self._block_items = []
+
+    def _open(self, block, out):
+        if self._block != block:
+            self._flush(out)
+            self._block = block
+
+    def _process_line(self, line, out):
+        if line.endswith('\r'):
+            line = line[:-1]
+        if self._block == 'code':
+            if _FENCE_RE.match(line):
+                self._flush(out)
+            else:
+                self._block_items.append(line)
+            return
+        if self.line_filter is not None:
+            line = self.line_filter(line)
+        if '`' in line or '~' in line:
+            if _FENCE_RE.match(line):
+                self._flush(out)
+                self._block = 'code'
+                return
+        stripped = line.strip()
+        if not stripped:
+            self._flush(out)
+            return
+        # Регулярные выражения блоков проверяются только при подходящем первом символе
+        first = stripped[0]
+        if first == '#':
+            match = _HEADING_RE.match(line)
+            if match:
+                self._flush(out)
+                level = len(match.group(1))
+                out.append(f"<h{level}>{render_inline(match.group(2))}</h{level}>")
+                return
+        elif first in '-*_+':
+            if _RULE_RE.match(line):
+                self._flush(out)
+                out.append("<hr>")
+                return
+            match = _UNORDERED_RE.match(line)
+            if match:
+                self._open('ul', out)
+                self._block_items.append(render_inline(match.group(1).strip()))
+                return
+        elif first.isdigit():
+            match = _ORDERED_RE.match(line)
+            if match:
+                if self._block != 'ol':
+                    self._open('ol', out)
+                    self._list_start = int(match.group(1))
+                self._block_items.append(render_inline(match.group(2).strip()))
+                return
+        if self._block in ('ul', 'ol') and line[:1].isspace() and self._block_items:
+            # Продолжение пункта списка на следующей строке с отступом
+            self._block_items[-1] += ' ' + render_inline(stripped)
+            return
+        self._open('p', out)
+        self._block_items.append(render_inline(stripped))
+
+
+def render_markdown(text, line_filter=None):
+    """Преобразует весь текст за один проход"""
+    renderer = MarkdownRenderer(line_filter)
+    return renderer.feed(text) + renderer.close()
+
+
+def build_result_html(text):
+    """Очищенный текст результата и его HTML; для больших документов HTML пустой"""
+    cleaned_text = clean_response(text)
+    if len(cleaned_text) > LARGE_DOCUMENT_CHARS:
+        return cleaned_text, ''
+    return cleaned_text, render_markdown(cleaned_text)
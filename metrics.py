@@ -0,0 +1,153 @@
+"""Метрики оптимизаций: задержки, токены и кэш, с выгрузкой в JSONL и формат Prometheus"""
+import sys
+import os
+import json
+import math
+import time
+import threading
+from collections import deque
+
+# Этапы задержки, для которых считаются перцентили
+LATENCY_STAGES = ('queue_wait', 'first_token_time', 'total_time')
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по методу ближайшего ранга для отсортированного списка"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class MetricsRecorder:
+    """Собирает метрики каждой оптимизации
+
+    Последние window значений каждого этапа хранятся для скользящих p50/p95.
+    Записи дописываются в metrics.jsonl, а сводка переписывается в metrics.prom.
+    """
+
+    def __init__(self, metrics_dir, window=500, max_log_bytes=10 * 1024 * 1024):
+        self.metrics_dir = metrics_dir
+        self.log_path = os.path.join(metrics_dir, 'metrics.jsonl')
+        self.prometheus_path = os.path.join(metrics_dir, 'metrics.prom')
+        self.max_log_bytes = max_log_bytes
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._recent = {stage: deque(maxlen=window) for stage in LATENCY_STAGES}
+        self._sums = {stage: 0.0 for stage in LATENCY_STAGES}
+        self._counts = {stage: 0 for stage in LATENCY_STAGES}
+        self.counters = {
+            'requests_ok': 0,
+            'requests_error': 0,
+            'cache_hit': 0,
+            'cache_miss': 0,
+            'prompt_tokens': 0,
+            'output_tokens': 0,
+            'tokens_saved': 0,
+            'retries': 0,
+            'throttled': 0,
+            'hedges_fired': 0,
+            'hedges_won': 0,
+        }
+
+    def increment(self, name, amount=1):
+        """Увеличивает именованный счетчик"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, **fields):
+        """Записывает одну оптимизацию; поля с None не учитываются в статистике"""
+        fields.setdefault('ts', time.time())
+        # Запись на диск под отдельной блокировкой: последним пишется самый свежий снимок
+        with self._io_lock:
+            with self._lock:
+                if fields.get('error'):
+                    self.counters['requests_error'] += 1
+                else:
+                    self.counters['requests_ok'] += 1
+                    self.counters['cache_hit' if fields.get('from_cache') else 'cache_miss'] += 1
+                    for stage in LATENCY_STAGES:
+                        value = fields.get(stage)
+                        if value is not None:
+                            self._recent[stage].append(value)
+                            self._sums[stage] += value
+                            self._counts[stage] += 1
+                for name in ('prompt_tokens', 'output_tokens', 'tokens_saved'):
+                    if fields.get(name):
+                        self.counters[name] += fields[name]
+                prometheus_text = self._prometheus_text()
+            try:
+                self._append_log(fields)
+                self._write_atomic(self.prometheus_path, prometheus_text)
+            except OSError as e:
+                print(f"Error writing metrics: {e}", file=sys.stderr)
+
+    def summary(self):
+        """Скользящие p50/p95 по этапам и счетчики"""
+        with self._lock:
+            result = {'counters': dict(self.counters)}
+            for stage in LATENCY_STAGES:
+                values = sorted(self._recent[stage])
+                result[stage] = {'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95)}
+            return result
+
+    def prometheus_text(self):
+        """Текущие метрики в текстовом формате Prometheus"""
+        with self._lock:
+            return self._prometheus_text()
+
+    def _append_log(self, fields):
+        if not os.path.exists(self.metrics_dir):
+            os.makedirs(self.metrics_dir)
+        # Простая ротация: при превышении размера прежний журнал сохраняется как .1
+        if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > self.max_log_bytes:
+            os.replace(self.log_path, self.log_path + '.1')
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(fields, ensure_ascii=False) + '\n')
+
+    def _write_atomic(self, path, text):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _prometheus_text(self):
+        counters = self.counters
+        lines = [
+            '# HELP prompt_optimizer_requests_total Completed optimizations by outcome.',
+            '# TYPE prompt_optimizer_requests_total counter',
+            f'prompt_optimizer_requests_total{{outcome="ok"}} {counters["requests_ok"]}',
+            f'prompt_optimizer_requests_total{{outcome="error"}} {counters["requests_error"]}',
+            '# HELP prompt_optimizer_cache_total Response cache lookups by result.',
+            '# TYPE prompt_optimizer_cache_total counter',
+            f'prompt_optimizer_cache_total{{result="hit"}} {counters["cache_hit"]}',
+            f'prompt_optimizer_cache_total{{result="miss"}} {counters["cache_miss"]}',
+            '# HELP prompt_optimizer_tokens_total Tokens reported by the backend.',
+            '# TYPE prompt_optimizer_tokens_total counter',
+            f'prompt_optimizer_tokens_total{{kind="prompt"}} {counters["prompt_tokens"]}',
+            f'prompt_optimizer_tokens_total{{kind="output"}} {counters["output_tokens"]}',
+            '# HELP prompt_optimizer_tokens_saved_total Prompt tokens removed by local pre-processing (estimate).',
+            '# TYPE prompt_optimizer_tokens_saved_total counter',
+            f'prompt_optimizer_tokens_saved_total {counters["tokens_saved"]}',
+            '# HELP prompt_optimizer_retries_total Retried API calls.',
+            '# TYPE prompt_optimizer_retries_total counter',
+            f'prompt_optimizer_retries_total {counters["retries"]}',
+            '# HELP prompt_optimizer_throttled_total API calls rejected with 429.',
+            '# TYPE prompt_optimizer_throttled_total counter',
+            f'prompt_optimizer_throttled_total {counters["throttled"]}',
+            '# HELP prompt_optimizer_hedges_total Duplicate requests sent for slow responses, and how many of them won.',
+            '# TYPE prompt_optimizer_hedges_total counter',
+            f'prompt_optimizer_hedges_total{{outcome="fired"}} {counters["hedges_fired"]}',
+            f'prompt_optimizer_hedges_total{{outcome="won"}} {counters["hedges_won"]}',
+            '# HELP prompt_optimizer_latency_seconds Optimization latency by stage over the recent window.',
+            '# TYPE prompt_optimizer_latency_seconds summary',
+        ]
+        for stage in LATENCY_STAGES:
+            values = sorted(self._recent[stage])
+            for quantile in (0.5, 0.95):
+                value = percentile(values, quantile)
+                if value is not None:
+                    lines.append(f'prompt_optimizer_latency_seconds{{stage="{stage}",quantile="{quantile}"}} {value:.6f}')
+            lines.append(f'prompt_optimizer_latency_seconds_sum{{stage="{stage}"}} {self._sums[stage]:.6f}')
+            lines.append(f'prompt_optimizer_latency_seconds_count{{stage="{stage}"}} {self._counts[stage]}')
+        return '\n'.join(lines) + '\n'
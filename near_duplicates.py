@@ -0,0 +1,105 @@
+"""Поиск почти одинаковых промптов: MinHash-отпечатки и LSH по полосам сигнатуры
+
+Текст нормализуется (регистр, пробелы, пунктуация) и разбивается на символьные
+n-граммы, поэтому правки в пробелах, знаках препинания или имени переменной
+меняют лишь малую долю n-грамм. Сигнатура делится на полосы: промпты с совпавшей
+хотя бы одной полосой становятся кандидатами, сходство которых затем уточняется.
+
+Стоимость отпечатка ограничена: у длинного текста берутся MAX_SHINGLES n-грамм
+с наименьшим crc32 (выборка bottom-k одинакова для похожих текстов), а тексты
+длиннее MAX_TEXT_CHARS не индексируются и не ищутся.
+"""
+import re
+import zlib
+import heapq
+import hashlib
+import struct
+
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+SHINGLE_CHARS = 5
+# Сколько n-грамм участвует в сигнатуре и сравнении: MinHash по всем n-граммам стоит секунды на мегабайт
+MAX_SHINGLES = 1024
+# Более длинные промпты не ищутся среди похожих: даже построение множества n-грамм заметно задерживает запрос
+MAX_TEXT_CHARS = 50_000
+
+# Порог сходства по умолчанию: почти тот же промпт с мелкими правками
+DEFAULT_THRESHOLD = 0.9
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_NON_WORD_RE = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def _permutations():
+    # Параметры перестановок фиксированы: сигнатуры в базе должны совпадать между запусками
+    params = []
+    for index in range(NUM_PERMUTATIONS):
+        digest = hashlib.blake2b(f"minhash-{index}".encode(), digest_size=16).digest()
+        a, b = struct.unpack('<QQ', digest)
+        params.append((a % (_MERSENNE_PRIME - 1) + 1, b % _MERSENNE_PRIME))
+    return params
+
+
+_PERMUTATIONS = _permutations()
+
+
+def normalize(text):
+    """Текст без регистра, пунктуации и лишних пробелов"""
+    return ' '.join(_NON_WORD_RE.sub(' ', text.lower()).split())
+
+
+def indexable(text):
+    """Ищется ли текст среди похожих"""
+    return len(text) <= MAX_TEXT_CHARS
+
+
+def _shingle_order(shingle):
+    return zlib.crc32(shingle.encode('utf-8'))
+
+
+def shingles(text):
+    """Символьные n-граммы нормализованного текста; у длинного текста - MAX_SHINGLES с наименьшим crc32"""
+    text = normalize(text)
+    if len(text) <= SHINGLE_CHARS:
+        return {text} if text else set()
+    result = {text[i:i + SHINGLE_CHARS] for i in range(len(text) - SHINGLE_CHARS + 1)}
+    if len(result) > MAX_SHINGLES:
+        result = set(heapq.nsmallest(MAX_SHINGLES, result, key=_shingle_order))
+    return result
+
+
+def jaccard(first, second):
+    """Сходство Жаккара двух множеств n-грамм
+
+    Для коротких текстов оно точное; если множества - выборки bottom-k, это оценка по
+    MAX_SHINGLES наименьшим n-граммам объединения, общая часть которых есть в обеих выборках.
+    """
+    if not first and not second:
+        return 1.0
+    union = first | second
+    if len(union) > MAX_SHINGLES:
+        union = heapq.nsmallest(MAX_SHINGLES, union, key=_shingle_order)
+    return sum(1 for shingle in union if shingle in first and shingle in second) / len(union)
+
+
+def minhash(shingle_set):
+    """MinHash-сигнатура из NUM_PERMUTATIONS значений"""
+    hashes = [struct.unpack('<I', hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest())[0]
+              for shingle in shingle_set]
+    if not hashes:
+        return [_MAX_HASH] * NUM_PERMUTATIONS
+    prime = _MERSENNE_PRIME
+    return [min((a * value + b) % prime for value in hashes) & _MAX_HASH for a, b in _PERMUTATIONS]
+
+
+def band_keys(signature):
+    """Ключи корзин LSH: по одному на полосу, номер полосы входит в ключ"""
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(struct.pack(f'<I{ROWS_PER_BAND}I', band, *rows), digest_size=8).digest()
+        # SQLite хранит знаковые 64-битные целые
+        keys.append(struct.unpack('<q', digest)[0])
+    return keys
@@ -0,0 +1,694 @@
+"""Асинхронный движок оптимизации промптов
+
+Используется окном приложения, пакетным режимом и может подключаться как библиотека:
+
+    optimizer = PromptOptimizer(api_key)
+    result = await optimizer.improve(prompt)
+    results = await optimizer.improve_many(prompts, concurrency=16)
+    async for index, result in optimizer.iter_improve(prompts):
+        ...
+"""
+import sys
+import time
+import asyncio
+import difflib
+from collections import deque
+
+from backends import GeminiBackend
+from optimizer_core import (GENERATION_CONFIG, LONG_PROMPT_TOKENS, SECTION_TOKENS, GenerationResult,
+                            split_prompt_sections, estimate_tokens, clean_response, score_variant,
+                            variant_generation_config, MAX_VARIANTS, SIMILAR_MODES, split_stable_segments,
+                            strip_sections)
+from templates import get_template, template_for_language, scenario_template
+from preprocess import prepare_prompt
+from rate_limit import RateLimiter, AdaptiveConcurrency, classify_error, retry_after, backoff_delay
+from response_cache import ResponseCache
+from metrics import percentile
+
+# Число одновременных запросов к API по умолчанию
+DEFAULT_CONCURRENCY = 8
+# Повторы при ошибках квоты (429) и временных сбоях (5xx)
+DEFAULT_MAX_RETRIES = 5
+# Дублирование медленных запросов: пока задержек мало, порог фиксирован, затем берется перцентиль
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = 5.0
+HEDGE_MIN_DELAY = 0.5
+HEDGE_WINDOW = 200
+# Пинг простаивающего соединения: чаще, чем балансировщики обычно закрывают неактивные каналы
+KEEPALIVE_INTERVAL = 240
+# После такого простоя пинги прекращаются, чтобы забытое открытым окно не обращалось к API бесконечно
+KEEPALIVE_MAX_IDLE = 3600
+
+
+class PromptOptimizer:
+    """Асинхронный оптимизатор: держит настроенную модель и ограничивает число запросов к API
+
+    rpm и tpm задают квоту запросов и токенов в минуту. Ошибки 429 и 5xx
+    повторяются с экспоненциальной задержкой, а число одновременных запросов
+    сужается при троттлинге и восстанавливается после успешных ответов.
+    Если передан metrics (MetricsRecorder), каждая оптимизация записывается в него.
+    Если передан history (HistoryStore), в нем сохраняются новые результаты, а при
+    промахе кэша ответов сначала ищется прежний результат того же запроса.
+    При similar_threshold в истории ищется и почти такой же промпт: в режиме
+    similar_mode='reuse' его результат возвращается сразу, в режиме 'baseline'
+    служит основой для нового запроса.
+    hedge_after включает дублирование: если ответ (в потоке - первый токен) не пришел
+    за столько секунд или за перцентиль вида 'p95' от недавних задержек, отправляется
+    второй запрос, при наличии - в hedge_backend. Берется более быстрый ответ, другой отменяется.
+    template - шаблон из реестра templates (имя, 'имя@версия' или PromptTemplate): его правила
+    уходят модели системной инструкцией, а в каждом запросе остается только промпт.
+    preprocess включает локальную подготовку промпта (preprocess.prepare_prompt): лишние пробелы
+    и повторы убираются, большие вставки данных заменяются метками и возвращаются в ответ,
+    а шаблон выбирается под язык промпта.
+    """
+
+    def __init__(self, api_key=None, backend=None, cache=None, concurrency=DEFAULT_CONCURRENCY,
+                 split_long=False, rpm=None, tpm=None, max_retries=DEFAULT_MAX_RETRIES, metrics=None,
+                 history=None, similar_threshold=None, similar_mode='reuse', hedge_after=None,
+                 hedge_backend=None, template='improve', preprocess=False):
+        if similar_mode not in SIMILAR_MODES:
+            raise ValueError(f"Unknown similar_mode: {similar_mode}")
+        self.hedge_after = hedge_after
+        self.template = get_template(template)
+        self.preprocess = preprocess
+        self.api_key = api_key
+        self.cache = cache
+        self.metrics = metrics
+        self.history = history
+        self.similar_threshold = similar_threshold
+        self.similar_mode = similar_mode
+        self.concurrency = concurrency
+        self.split_long = split_long
+        self.max_retries = max_retries
+        self.rate_limiter = RateLimiter(rpm, tpm)
+        self.limiter = AdaptiveConcurrency(concurrency)
+        self.retry_count = 0
+        self.throttle_count = 0
+        self.hedge_backend = hedge_backend
+        self.hedge_count = 0
+        self.hedge_wins = 0
+        # Недавние задержки ответов API: отдельно до первого токена в потоке и до полного ответа
+        self._latencies = {True: deque(maxlen=HEDGE_WINDOW), False: deque(maxlen=HEDGE_WINDOW)}
+        self._backend = backend
+        # Время последнего обращения к API: по нему keep_alive решает, нужен ли пинг
+        self._last_activity = time.monotonic()
+        # Сегменты и их улучшенные версии из последнего инкрементального запуска
+        self._incremental_segments = []
+
+    @property
+    def backend(self):
+        """Бэкенд генерации; по умолчанию Gemini с ключом api_key"""
+        if self._backend is None:
+            self._backend = GeminiBackend(self.api_key)
+        return self._backend
+
+    async def count_tokens(self, text):
+        """Точное число токенов через API, при ошибке - локальная оценка"""
+        try:
+            return await self.backend.count_tokens(text)
+        except Exception as e:
+            print(f"Error counting tokens: {e}", file=sys.stderr)
+            return estimate_tokens(text)
+
+    async def warm_up(self, probe=True):
+        """Готовит клиент и соединение заранее, чтобы первый запрос был не медленнее следующих
+
+        При probe бэкенд отправляет крошечный бесплатный запрос (count_tokens), который
+        открывает соединение. Ошибки прогрева не считаются ошибками оптимизации.
+        """
+        backends = [self.backend] + ([self.hedge_backend] if self.hedge_backend is not None else [])
+        for backend in backends:
+            if not hasattr(backend, 'warm_up'):
+                continue
+            try:
+                await backend.warm_up(self.template.system_instruction, probe=probe)
+            except Exception as e:
+                print(f"Warm-up failed: {e}", file=sys.stderr)
+                return False
+        return True
+
+    async def keep_alive(self, interval=KEEPALIVE_INTERVAL, max_idle=KEEPALIVE_MAX_IDLE):
+        """Пока нет запросов, раз в interval секунд пингует API, чтобы соединение оставалось открытым
+
+        Запускается отдельной задачей и работает до отмены; после max_idle секунд
+        без настоящих запросов пинги приостанавливаются до следующего запроса.
+        """
+        last_ping = time.monotonic()
+        while True:
+            await asyncio.sleep(interval - (time.monotonic() - max(self._last_activity, last_ping)))
+            now = time.monotonic()
+            if now - max(self._last_activity, last_ping) < interval:
+                continue
+            if now - self._last_activity > max_idle:
+                # Отсчет начинается заново с первого запроса после простоя
+                last_ping = now
+                continue
+            await self.warm_up()
+            last_ping = time.monotonic()
+
+    def _prepare(self, prompt, preprocess):
+        """Промпт для отправки, шаблон и подготовка (или None, если она выключена)"""
+        if preprocess is None:
+            preprocess = self.preprocess
+        if not preprocess:
+            return prompt, self.template, None
+        prepared = prepare_prompt(prompt)
+        return prepared.text, self._localized(self.template, prepared), prepared
+
+    @staticmethod
+    def _localized(template, prepared):
+        """Шаблон на языке подготовленного промпта: все запросы одного вызова - на одном языке"""
+        if prepared is None:
+            return template
+        return template_for_language(template, prepared.language)
+
+    def _scenario_template(self, scenario, prepared=None):
+        """Шаблон сценария той же версии, что и шаблон оптимизатора, на языке промпта"""
+        return self._localized(scenario_template(self.template, scenario), prepared)
+
+    async def improve(self, prompt, stream=False, on_chunk=None, use_cache=True, split_long=None,
+                      similar_threshold=None, similar_mode=None, preprocess=None):
+        """Улучшает один промпт
+
+        В потоковом режиме фрагменты ответа передаются в on_chunk по мере поступления.
+        Промпты длиннее LONG_PROMPT_TOKENS при split_long улучшаются по разделам.
+        similar_threshold, similar_mode и preprocess заменяют настройки оптимизатора для этого вызова.
+        """
+        if not prompt or not prompt.strip():
+            raise ValueError("Пустой промпт")
+        if split_long is None:
+            split_long = self.split_long
+        if similar_threshold is None:
+            similar_threshold = self.similar_threshold
+        similar_mode = similar_mode or self.similar_mode
+        request_prompt, template, prepared = self._prepare(prompt, preprocess)
+        flush_chunks = None
+        if prepared is not None and on_chunk is not None:
+            # В потоке метки данных заменяются на лету, в том числе разорванные между фрагментами
+            on_chunk, flush_chunks = prepared.restoring(on_chunk)
+        try:
+            start_time = time.perf_counter()
+            similar = await self._find_similar(prompt, similar_threshold, template) if use_cache else None
+            # Промпт, совпадающий после нормализации, не улучшается заново и в режиме основы
+            if similar is not None and (similar_mode == 'reuse' or similar[0] >= 1.0):
+                # Почти тот же промпт уже оптимизирован: результат отдается без запроса к API
+                similarity, entry = similar
+                elapsed = time.perf_counter() - start_time
+                result = GenerationResult(entry['result'], elapsed, elapsed, from_cache=True, similarity=similarity)
+                if on_chunk is not None and stream:
+                    on_chunk(entry['result'])
+                request_key = None
+            # Токены считаются через API только для текстов, которые могут превысить порог
+            elif split_long and len(request_prompt) > LONG_PROMPT_TOKENS \
+                    and await self.count_tokens(request_prompt) > LONG_PROMPT_TOKENS:
+                result = await self._improve_sections(request_prompt, on_chunk, use_cache,
+                                                      self._scenario_template('section', prepared))
+                # Результат по разделам не совпадает с ответом на весь промпт и не служит для поиска
+                request_key = None
+            else:
+                if similar is not None:
+                    similarity, entry = similar
+                    result = await self._generate(request_prompt, self._scenario_template('baseline', prepared),
+                                                  stream, on_chunk,
+                                                  use_cache, fields={'similar_prompt': entry['prompt'],
+                                                                     'similar_result': entry['result']})
+                    result.similarity = similarity
+                else:
+                    result = await self._generate(request_prompt, template, stream, on_chunk, use_cache)
+                request_key = self._request_key(request_prompt, template, GENERATION_CONFIG)
+            if prepared is not None:
+                if flush_chunks is not None:
+                    flush_chunks()
+                result.text = prepared.restore(result.text)
+                if not result.from_cache:
+                    result.tokens_saved = prepared.tokens_saved
+                if prepared.blobs:
+                    # Ответ с другими данными под теми же метками нельзя отдавать по ключу запроса
+                    request_key = None
+        except Exception as e:
+            await self._record_metrics(prompt, error=str(e))
+            raise
+        await self._record_metrics(prompt, result=result)
+        await self._record_history(prompt, result, template, GENERATION_CONFIG, request_key)
+        return result
+
+    async def improve_incremental(self, prompt, on_chunk=None, use_cache=True):
+        """Улучшает промпт по сегментам, пересчитывая только измененные с прошлого вызова
+
+        Новый промпт сравнивается с предыдущим посегментно: совпавшие сегменты берут
+        прежний результат, остальные отправляются параллельно. После правки одной
+        строки время и расход токенов зависят от размера правки, а не всего промпта.
+        Промпт из одного сегмента улучшается целиком, как в improve().
+        """
+        if not prompt or not prompt.strip():
+            raise ValueError("Пустой промпт")
+        separators, segments = zip(*strip_sections(split_stable_segments(prompt)))
+        if len(segments) < 2:
+            self._incremental_segments = []
+            return await self.improve(prompt, stream=on_chunk is not None, on_chunk=on_chunk, use_cache=use_cache)
+        previous = self._incremental_segments
+        reused = {}
+        if use_cache and previous:
+            matcher = difflib.SequenceMatcher(None, [segment for segment, _ in previous], segments, autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag == 'equal':
+                    for offset in range(i2 - i1):
+                        reused[j1 + offset] = previous[i1 + offset][1]
+        template = self._scenario_template('segment')
+        start_time = time.perf_counter()
+        tasks = []
+        for index, segment in enumerate(segments):
+            if index in reused:
+                future = asyncio.get_running_loop().create_future()
+                future.set_result(GenerationResult(reused[index], 0.0, 0.0, from_cache=True))
+                tasks.append(future)
+            else:
+                # Измененный сегмент все равно может найтись в кэше ответов
+                tasks.append(asyncio.ensure_future(self._generate(segment, template, use_cache=use_cache)))
+        try:
+            result, texts = await self._assemble_sections(tasks, separators, on_chunk, start_time)
+        except Exception as e:
+            await self._record_metrics(prompt, error=str(e))
+            raise
+        result.segments = (len(segments) - len(reused), len(segments))
+        self._incremental_segments = list(zip(segments, texts))
+        await self._record_metrics(prompt, result=result)
+        await self._record_history(prompt, result, self.template, GENERATION_CONFIG, None)
+        return result
+
+    async def improve_variants(self, prompt, count=3, on_variant=None, use_cache=True, preprocess=None):
+        """Генерирует count вариантов параллельно с разными температурами
+
+        on_variant(index, result, score) вызывается по мере готовности каждого варианта.
+        Возвращает пары (оценка, результат), отсортированные от лучшей к худшей.
+        Ошибка одного варианта не отменяет остальные; исключение - только если не удался ни один.
+        """
+        if not prompt or not prompt.strip():
+            raise ValueError("Пустой промпт")
+        count = max(1, min(count, MAX_VARIANTS))
+        request_prompt, template, prepared = self._prepare(prompt, preprocess)
+
+        async def run_variant(index):
+            generation_config = variant_generation_config(index)
+            try:
+                result = await self._generate(request_prompt, template, use_cache=use_cache,
+                                              generation_config=generation_config)
+            except Exception as e:
+                await self._record_metrics(prompt, error=str(e))
+                raise
+            request_key = self._request_key(request_prompt, template, generation_config)
+            if prepared is not None:
+                result.text = prepared.restore(result.text)
+                if not result.from_cache:
+                    result.tokens_saved = prepared.tokens_saved
+                if prepared.blobs:
+                    request_key = None
+            await self._record_metrics(prompt, result=result)
+            await self._record_history(prompt, result, template, generation_config, request_key)
+            return index, result
+
+        ranked = []
+        errors = []
+        tasks = [asyncio.ensure_future(run_variant(index)) for index in range(count)]
+        try:
+            for future in asyncio.as_completed(tasks):
+                try:
+                    index, result = await future
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                score = score_variant(prompt, clean_response(result.text))
+                ranked.append((score, result))
+                if on_variant is not None:
+                    on_variant(index, result, score)
+        finally:
+            # При отмене запроса незавершенные варианты не должны продолжать расходовать квоту
+            for task in tasks:
+                task.cancel()
+        if not ranked:
+            raise errors[0]
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        return ranked
+
+    async def _record_metrics(self, prompt, result=None, error=None):
+        if self.metrics is None:
+            return
+        fields = {'model': self.backend.model_name, 'prompt_chars': len(prompt)}
+        if error is not None:
+            fields['error'] = error
+        else:
+            fields.update(
+                from_cache=result.from_cache,
+                queue_wait=result.queue_wait,
+                first_token_time=result.first_token_time,
+                total_time=result.total_time,
+                prompt_tokens=result.prompt_tokens,
+                output_tokens=result.output_tokens,
+                tokens_saved=result.tokens_saved,
+            )
+        # Запись на диск не должна задерживать цикл событий
+        await asyncio.to_thread(self.metrics.record, **fields)
+
+    def _request_key(self, prompt, template, generation_config, fields=None):
+        # Шаблон входит в ключ отпечатком содержимого вместе со значениями его полей
+        template_key = {'template': template.key, 'fingerprint': template.fingerprint}
+        if fields:
+            template_key['fields'] = fields
+        return ResponseCache.make_key(prompt, self.backend.model_name, template_key, generation_config)
+
+    async def _record_history(self, prompt, result, template, generation_config, request_key):
+        # Ответы из кэша и истории уже сохранены ранее
+        if self.history is None or result.from_cache:
+            return
+        try:
+            await asyncio.to_thread(
+                self.history.add, prompt, clean_response(result.text),
+                model=self.backend.model_name,
+                generation_config=generation_config,
+                request_key=request_key,
+                template=self._history_template(template),
+                first_token_time=result.first_token_time,
+                total_time=result.total_time,
+                prompt_tokens=result.prompt_tokens,
+                output_tokens=result.output_tokens
+            )
+        except Exception as e:
+            print(f"Error writing history: {e}", file=sys.stderr)
+
+    async def improve_many(self, prompts, concurrency=None, use_cache=True, split_long=None,
+                           return_exceptions=False):
+        """Улучшает список промптов параллельно и возвращает результаты в исходном порядке"""
+        prompts = list(prompts)
+        results = [None] * len(prompts)
+        async for index, result in self.iter_improve(prompts, concurrency, use_cache, split_long):
+            if isinstance(result, Exception) and not return_exceptions:
+                raise result
+            results[index] = result
+        return results
+
+    async def iter_improve(self, prompts, concurrency=None, use_cache=True, split_long=None, ordered=False):
+        """Асинхронно перебирает пары (индекс, результат) по мере готовности
+
+        prompts читается лениво, в работе не больше concurrency промптов одновременно.
+        Ошибка отдельного промпта возвращается как результат-исключение.
+        При ordered=True результаты выдаются в порядке входа.
+        """
+        limit = max(1, concurrency or self.concurrency)
+        source = enumerate(prompts)
+        pending = {}
+        buffered = {}
+        next_to_yield = 0
+        exhausted = False
+
+        def fill():
+            nonlocal exhausted
+            # Буфер упорядоченного режима входит в лимит, чтобы память оставалась ограниченной
+            while not exhausted and len(pending) + len(buffered) < limit:
+                try:
+                    index, prompt = next(source)
+                except StopIteration:
+                    exhausted = True
+                    return
+                task = asyncio.ensure_future(self.improve(prompt, use_cache=use_cache, split_long=split_long))
+                pending[task] = index
+
+        try:
+            fill()
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        result = e
+                    if ordered:
+                        buffered[index] = result
+                    else:
+                        yield index, result
+                while next_to_yield in buffered:
+                    yield next_to_yield, buffered.pop(next_to_yield)
+                    next_to_yield += 1
+                fill()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _cache_get(self, key):
+        return await asyncio.to_thread(self.cache.get, key)
+
+    @staticmethod
+    def _history_template(template):
+        # Имя с версией и отпечаток: результат по другим правилам не выдается за ответ на текущий запрос
+        return f"{template.key}:{template.fingerprint}"
+
+    async def _find_similar(self, prompt, threshold, template):
+        if self.history is None or threshold is None:
+            return None
+        try:
+            return await asyncio.to_thread(self.history.find_similar, prompt, threshold,
+                                           model=self.backend.model_name, generation_config=GENERATION_CONFIG,
+                                           template=self._history_template(template))
+        except Exception as e:
+            print(f"Error searching similar prompts: {e}", file=sys.stderr)
+            return None
+
+    async def _history_lookup(self, key):
+        try:
+            return await asyncio.to_thread(self.history.lookup, key)
+        except Exception as e:
+            print(f"Error reading history: {e}", file=sys.stderr)
+            return None
+
+    async def _cache_put(self, key, text):
+        try:
+            await asyncio.to_thread(self.cache.put, key, text)
+        except OSError as e:
+            print(f"Error writing response cache: {e}", file=sys.stderr)
+
+    async def _generate(self, prompt, template, stream=False, on_chunk=None, use_cache=True,
+                        generation_config=GENERATION_CONFIG, fields=None):
+        fields = fields or {}
+        start_time = time.perf_counter()
+        cache_key = None
+        if self.cache is not None or self.history is not None:
+            cache_key = self._request_key(prompt, template, generation_config, fields)
+        if cache_key is not None and use_cache:
+            cached_text = await self._cache_get(cache_key) if self.cache is not None else None
+            if not cached_text and self.history is not None:
+                # История хранит все результаты без срока жизни и ограничения размера
+                cached_text = await self._history_lookup(cache_key)
+                if cached_text and self.cache is not None:
+                    await self._cache_put(cache_key, cached_text)
+            if cached_text:
+                elapsed = time.perf_counter() - start_time
+                return GenerationResult(cached_text, elapsed, elapsed, from_cache=True)
+
+        request = template.render(prompt, **fields)
+        # Системная инструкция тоже входит в квоту токенов; ответ обычно сопоставим с промптом по длине
+        reserved_tokens = (estimate_tokens(template.system_instruction) + estimate_tokens(request)
+                           + estimate_tokens(prompt))
+        first_token_time = None
+
+        def on_stream_chunk(text):
+            nonlocal first_token_time
+            if first_token_time is None:
+                first_token_time = time.perf_counter() - start_time
+            if on_chunk is not None:
+                on_chunk(text)
+
+        handle_chunk = on_stream_chunk if stream else None
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire(reserved_tokens)
+            try:
+                async with self.limiter:
+                    # Ожидание квоты и свободного слота, включая паузы между повторами
+                    queue_wait = time.perf_counter() - start_time
+                    response, hedge_won = await self._call_backend(request, template.system_instruction,
+                                                                   generation_config, handle_chunk, reserved_tokens)
+                result = response.text
+            except Exception as e:
+                kind = classify_error(e)
+                # Поток, уже показанный пользователю, повторять нельзя
+                if kind is None or attempt >= self.max_retries or first_token_time is not None:
+                    raise
+                if kind == 'throttle':
+                    self.throttle_count += 1
+                    self.limiter.on_throttle()
+                    if self.metrics is not None:
+                        self.metrics.increment('throttled')
+                delay = backoff_delay(attempt, hint=retry_after(e))
+                print(f"Retrying after {kind} error in {delay:.1f}s: {e}", file=sys.stderr)
+                self.retry_count += 1
+                if self.metrics is not None:
+                    self.metrics.increment('retries')
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            await self.limiter.on_success()
+            break
+        total_time = time.perf_counter() - start_time
+        if first_token_time is None:
+            first_token_time = total_time
+        if not result:
+            raise RuntimeError("Не удалось получить ответ от API")
+        # Ответ запасной модели не сохраняется под ключом основной
+        if self.cache is not None and not (hedge_won and self.hedge_backend is not None):
+            await self._cache_put(cache_key, result)
+        return GenerationResult(result, first_token_time, total_time, queue_wait=queue_wait,
+                                prompt_tokens=response.prompt_tokens, output_tokens=response.output_tokens)
+
+    @property
+    def hedge_after(self):
+        return self._hedge_after
+
+    @hedge_after.setter
+    def hedge_after(self, value):
+        if isinstance(value, str):
+            if not value.startswith('p') or not value[1:].replace('.', '', 1).isdigit() \
+                    or not 0 < float(value[1:]) < 100:
+                raise ValueError(f"hedge_after must be seconds or a percentile like 'p95', got {value!r}")
+            self._hedge_fraction = float(value[1:]) / 100
+        self._hedge_after = value
+
+    def _hedge_delay(self, streaming):
+        """Через сколько секунд без ответа отправлять дубликат, или None, если дублирование выключено"""
+        if self._hedge_after is None:
+            return None
+        if not isinstance(self._hedge_after, str):
+            return self._hedge_after
+        samples = sorted(self._latencies[streaming])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, percentile(samples, self._hedge_fraction))
+
+    async def _call_backend(self, request, system_instruction, generation_config, on_chunk, reserved_tokens):
+        """Запрос к бэкенду с дублированием медленного ответа
+
+        В потоке побеждает запрос, первым приславший фрагмент, иначе - первым вернувший ответ.
+        Возвращает пару (ответ, победил ли дубликат).
+        """
+        streaming = on_chunk is not None
+        start_time = time.perf_counter()
+        self._last_activity = time.monotonic()
+        tasks = {}
+        winner = None
+
+        def chunk_handler(name):
+            def handle(text):
+                nonlocal winner
+                if winner is None:
+                    winner = name
+                    self._latencies[True].append(time.perf_counter() - start_time)
+                    # Проигравший поток прерывается сразу, не дожидаясь конца ответа
+                    for other, task in tasks.items():
+                        if other != name:
+                            task.cancel()
+                if winner == name:
+                    on_chunk(text)
+            return handle if streaming else None
+
+        tasks['primary'] = asyncio.ensure_future(
+            self.backend.generate(request, generation_config, on_chunk=chunk_handler('primary'),
+                                  system_instruction=system_instruction)
+        )
+        try:
+            delay = self._hedge_delay(streaming)
+            if delay is not None:
+                await asyncio.wait([tasks['primary']], timeout=delay)
+                if winner is None and not tasks['primary'].done():
+                    # Дубликат расходует квоту, как обычный запрос
+                    await self.rate_limiter.acquire(reserved_tokens)
+                    if winner is None and not tasks['primary'].done():
+                        self.hedge_count += 1
+                        if self.metrics is not None:
+                            self.metrics.increment('hedges_fired')
+                        backend = self.hedge_backend or self.backend
+                        tasks['hedge'] = asyncio.ensure_future(
+                            backend.generate(request, generation_config, on_chunk=chunk_handler('hedge'),
+                                             system_instruction=system_instruction)
+                        )
+            names = {task: name for name, task in tasks.items()}
+            pending = set(tasks.values())
+            errors = []
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is not None:
+                        # Ошибка одного из запросов не мешает дождаться другого
+                        errors.append(task.exception())
+                        continue
+                    name = names[task]
+                    if winner is not None and winner != name:
+                        continue
+                    if not streaming:
+                        self._latencies[False].append(time.perf_counter() - start_time)
+                    if name == 'hedge':
+                        self.hedge_wins += 1
+                        if self.metrics is not None:
+                            self.metrics.increment('hedges_won')
+                    return task.result(), name == 'hedge'
+            raise errors[0]
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    async def _improve_sections(self, prompt, on_chunk=None, use_cache=True, template=None):
+        """Улучшает длинный промпт по разделам параллельно и собирает их в исходном порядке
+
+        Время ответа определяется самым длинным разделом, а не общей длиной промпта.
+        on_chunk получает разделы по порядку, как только готовы все предыдущие.
+        """
+        start_time = time.perf_counter()
+        separators, sections = zip(*strip_sections(split_prompt_sections(prompt, SECTION_TOKENS)))
+        total = len(sections)
+        template = template or self._scenario_template('section')
+        tasks = [
+            asyncio.ensure_future(self._generate(section, template, use_cache=use_cache,
+                                                 fields={'index': index + 1, 'total': total}))
+            for index, section in enumerate(sections)
+        ]
+        result, _ = await self._assemble_sections(tasks, separators, on_chunk, start_time)
+        return result
+
+    async def _assemble_sections(self, tasks, separators, on_chunk, start_time):
+        """Ждет разделы по порядку и собирает общий результат
+
+        Перед каждым разделом ставится его разделитель из исходного промпта (strip_sections).
+        Возвращает пару (результат, очищенные тексты разделов).
+        """
+        texts = []
+        first_token_time = None
+        try:
+            # Ожидание задач по порядку: готовые раньше разделы просто ждут своей очереди
+            for index, task in enumerate(tasks):
+                text = clean_response((await task).text)
+                if first_token_time is None:
+                    first_token_time = time.perf_counter() - start_time
+                if on_chunk is not None:
+                    on_chunk(separators[index] + text)
+                texts.append(text)
+        finally:
+            # Оставшиеся разделы не отправляются, если один из них упал или запрос отменен
+            for task in tasks:
+                task.cancel()
+        total_time = time.perf_counter() - start_time
+        results = [task.result() for task in tasks]
+        return GenerationResult(
+            ''.join(separator + text for separator, text in zip(separators, texts)),
+            first_token_time or total_time, total_time,
+            from_cache=all(result.from_cache for result in results),
+            # Разделы ждут параллельно, поэтому ожидание всего промпта - самое долгое из них
+            queue_wait=max(result.queue_wait for result in results),
+            prompt_tokens=_sum_known(result.prompt_tokens for result in results),
+            output_tokens=_sum_known(result.output_tokens for result in results)
+        ), texts
+
+
+def _sum_known(values):
+    """Сумма известных значений или None, если неизвестно ни одно"""
+    known = [value for value in values if value is not None]
+    return sum(known) if known else None
@@ -0,0 +1,345 @@
+"""Локальная подготовка промпта перед отправкой: меньше токенов без потери смысла
+
+Все шаги выполняются локально, без обращения к сети:
+    - большие вставки данных (JSON, CSV, base64) заменяются метками вида ⟦JSON_1⟧
+      и возвращаются в ответ после генерации;
+    - лишние пробелы и пустые строки схлопываются (код в ``` не трогается);
+    - подряд идущие одинаковые строки и повторы целых абзацев удаляются;
+    - по алфавиту текста определяется язык, под который выбирается шаблон.
+"""
+import re
+import csv
+import json
+import bisect
+
+from optimizer_core import estimate_tokens
+
+# Вставки короче порога не выносятся: метка и ее восстановление не окупаются
+MIN_BLOB_CHARS = 400
+# Повтор абзаца короче порога может быть намеренным (разделитель, короткий заголовок)
+MIN_DUPLICATE_BLOCK_CHARS = 40
+# Сколько строк подряд с одинаковым числом разделителей считается таблицей CSV
+MIN_CSV_LINES = 5
+# Поле таблицы - значение или короткая фраза; в среднем больше слов на поле бывает в обычном тексте
+MAX_CSV_WORDS_PER_FIELD = 3
+# Неудачный разбор JSON стоит O(длины текста), поэтому число неудач на промпт ограничено
+MAX_JSON_FAILURES = 32
+
+_FENCE_RE = re.compile(r'^\s*(```|~~~)')
+_BASE64_RE = re.compile(r'(?:data:[\w/+.-]+;base64,)?[A-Za-z0-9+/]{%d,}={0,2}' % MIN_BLOB_CHARS)
+_PLACEHOLDER_RE = re.compile(r'⟦(JSON|CSV|BASE64|DATA)_(\d+)⟧')
+# Строка, похожая на начало JSON: разбор дорог, поэтому обычный текст в скобках отсекается заранее
+_JSON_START_RE = re.compile(r'^\s*(\{\s*("|\}|$)|\[\s*([\[{"\d\]-]|true|false|null|$))')
+_INNER_SPACES_RE = re.compile(r'(?<=\S)[ \t]{2,}')
+_CYRILLIC_RE = re.compile(r'[А-Яа-яЁё]')
+_LATIN_RE = re.compile(r'[A-Za-z]')
+_CSV_DELIMITERS = (',', ';', '\t')
+# Маркер списка, заголовка или цитаты в начале строки: это текст, а не строка таблицы
+_LIST_MARKER_RE = re.compile(r'^\s*([-*+•>#]|\d{1,3}[.)])\s')
+_SENTENCE_END_RE = re.compile(r'[.!?:;…]\s*$')
+_NUMBER_RE = re.compile(r'^[-+]?[\d\s.,%$€₽]+$')
+_JSON_DECODER = json.JSONDecoder()
+
+
+class PreparedPrompt:
+    """Подготовленный промпт: текст для отправки, вынесенные данные и язык"""
+
+    def __init__(self, original, text, blobs, language):
+        self.original = original
+        self.text = text
+        self.blobs = blobs
+        self.language = language
+        self.tokens_before = estimate_tokens(original)
+        self.tokens_after = estimate_tokens(text)
+
+    @property
+    def tokens_saved(self):
+        return max(0, self.tokens_before - self.tokens_after)
+
+    def restore(self, text):
+        """Возвращает вынесенные данные на место меток; потерянные моделью метки дописываются в конец"""
+        if not self.blobs:
+            return text
+        used = set()
+
+        def replace(match):
+            key = match.group(0)
+            if key in self.blobs:
+                used.add(key)
+                return self.blobs[key]
+            return key
+
+        text = _PLACEHOLDER_RE.sub(replace, text)
+        # Данные пользователя не должны пропасть, даже если модель выбросила метку
+        missing = [blob for key, blob in self.blobs.items() if key not in used]
+        return "\n\n".join([text] + missing) if missing else text
+
+    def restoring(self, on_chunk):
+        """Обертка on_chunk для потока: метки заменяются данными, даже если пришли по частям
+
+        Возвращает пару (обработчик фрагментов, функция дописать остаток).
+        """
+        if not self.blobs:
+            return on_chunk, lambda: None
+        pending = ''
+
+        def handle(text):
+            nonlocal pending
+            pending += text
+            # Начало метки без закрывающей скобки ждет следующего фрагмента
+            cut = pending.rfind('⟦')
+            if cut != -1 and '⟧' not in pending[cut:]:
+                ready, pending = pending[:cut], pending[cut:]
+            else:
+                ready, pending = pending, ''
+            if ready:
+                on_chunk(self._substitute(ready))
+
+        def flush():
+            nonlocal pending
+            if pending:
+                rest, pending = pending, ''
+                on_chunk(self._substitute(rest))
+
+        return handle, flush
+
+    def _substitute(self, text):
+        return _PLACEHOLDER_RE.sub(lambda match: self.blobs.get(match.group(0), match.group(0)), text)
+
+
+def detect_language(text):
+    """'ru', 'en' или None по доле кириллицы среди букв"""
+    cyrillic = len(_CYRILLIC_RE.findall(text))
+    latin = len(_LATIN_RE.findall(text))
+    letters = cyrillic + latin
+    if not letters:
+        return None
+    if cyrillic / letters > 0.3:
+        return 'ru'
+    if cyrillic / letters < 0.05:
+        return 'en'
+    return None
+
+
+def prepare_prompt(prompt, extract_data=True):
+    """Подготавливает промпт к отправке"""
+    blobs = {}
+    lines = prompt.splitlines()
+    if extract_data:
+        lines = _extract_blobs(lines, blobs)
+    text = _dedupe(_collapse_whitespace(lines))
+    if extract_data:
+        # base64 встречается и посреди строки, например в data: URI
+        text = _BASE64_RE.sub(lambda match: _add_blob(blobs, 'BASE64', match.group(0)), text)
+    # Язык определяется по тексту без данных: JSON с латинскими ключами не делает промпт английским
+    return PreparedPrompt(prompt, text, blobs, detect_language(_PLACEHOLDER_RE.sub('', text)))
+
+
+def _add_blob(blobs, kind, content):
+    key = f"⟦{kind}_{len(blobs) + 1}⟧"
+    blobs[key] = content
+    return key
+
+
+def _extract_blobs(lines, blobs):
+    """Заменяет большие блоки кода с данными, JSON и таблицы CSV метками"""
+    result = []
+    # Общий текст и смещения строк: JSON разбирается прямо в нем, без склейки хвоста для каждой строки
+    text = "\n".join(lines)
+    line_starts = []
+    offset = 0
+    for line in lines:
+        line_starts.append(offset)
+        offset += len(line) + 1
+    json_failures = 0
+    csv_rejected_until = -1
+    index = 0
+    while index < len(lines):
+        line = lines[index]
+        if _FENCE_RE.match(line):
+            end = _fence_end(lines, index)
+            block = lines[index:end + 1]
+            closed = end > index and _FENCE_RE.match(lines[end])
+            body = "\n".join(block[1:-1] if closed else block[1:])
+            kind = _data_kind(body)
+            if kind is not None and len(body) >= MIN_BLOB_CHARS:
+                result.append(_add_blob(blobs, kind, "\n".join(block)))
+            else:
+                result.extend(block)
+            index = end + 1
+            continue
+        if json_failures < MAX_JSON_FAILURES and _JSON_START_RE.match(line):
+            end = _json_end(text, line_starts, index)
+            if end is None:
+                json_failures += 1
+            else:
+                block = "\n".join(lines[index:end + 1])
+                if len(block) >= MIN_BLOB_CHARS:
+                    result.append(_add_blob(blobs, 'JSON', block))
+                    index = end + 1
+                    continue
+        run = _csv_run(lines, index) if index > csv_rejected_until else None
+        if run is not None:
+            end, is_table = run
+            block = "\n".join(lines[index:end + 1])
+            if is_table and len(block) >= MIN_BLOB_CHARS:
+                result.append(_add_blob(blobs, 'CSV', block))
+                index = end + 1
+                continue
+            if not is_table:
+                # Строки отвергнутого участка не проверяются заново с каждой следующей: иначе разбор квадратичен
+                csv_rejected_until = end
+        result.append(line)
+        index += 1
+    return result
+
+
+def _fence_end(lines, start):
+    """Индекс закрывающей строки блока кода или последней строки текста"""
+    for index in range(start + 1, len(lines)):
+        if _FENCE_RE.match(lines[index]):
+            return index
+    return len(lines) - 1
+
+
+def _data_kind(body):
+    """Тип данных в блоке кода или None, если это код или текст"""
+    stripped = body.strip()
+    if stripped[:1] in ('{', '['):
+        try:
+            json.loads(stripped)
+            return 'JSON'
+        except ValueError:
+            pass
+    if _BASE64_RE.fullmatch(stripped):
+        return 'BASE64'
+    lines = stripped.splitlines()
+    if lines and _csv_run(lines, 0) == (len(lines) - 1, True):
+        return 'CSV'
+    return None
+
+
+def _json_end(text, line_starts, start):
+    """Индекс последней строки JSON-значения, начинающегося в строке start, или None"""
+    offset = line_starts[start]
+    while text[offset] in ' \t':
+        offset += 1
+    try:
+        _, end = _JSON_DECODER.raw_decode(text, offset)
+    except ValueError:
+        return None
+    # После значения в той же строке может быть только пробел или запятая
+    line_end = text.find('\n', end)
+    if text[end:line_end if line_end != -1 else len(text)].strip(' \t,'):
+        return None
+    return bisect.bisect_right(line_starts, end - 1) - 1
+
+
+def _csv_run(lines, start):
+    """Пара (индекс последней строки, таблица ли это) для строк с разделителями от start или None
+
+    Одинакового числа разделителей мало: список правил с двумя запятыми в каждом пункте
+    тоже его дает. Поэтому строки не должны быть пунктами списка или предложениями,
+    у таблицы должен быть заголовок, а поля - одной формы во всех строках.
+    """
+    first = lines[start] if start < len(lines) else ''
+    if _is_text_line(first):
+        return None
+    rejected = None
+    for delimiter in _CSV_DELIMITERS:
+        columns = first.count(delimiter)
+        if columns < 2:
+            continue
+        end = start
+        while end + 1 < len(lines) and lines[end + 1].count(delimiter) == columns \
+                and not _is_text_line(lines[end + 1]):
+            end += 1
+        if end - start + 1 >= MIN_CSV_LINES:
+            if _is_table(lines[start:end + 1], delimiter):
+                return end, True
+            rejected = max(end, rejected if rejected is not None else end)
+    return None if rejected is None else (rejected, False)
+
+
+def _is_text_line(line):
+    return not line.strip() or bool(_LIST_MARKER_RE.match(line) or _SENTENCE_END_RE.search(line))
+
+
+def _is_table(lines, delimiter):
+    """Строки с одинаковым числом полей, заголовком и одним типом значений в каждом столбце"""
+    rows = [[field.strip() for field in row] for row in csv.reader(lines, delimiter=delimiter)]
+    width = len(rows[0])
+    if any(len(row) != width for row in rows):
+        return False
+    header, data = rows[0], rows[1:]
+    # Заголовок: непустые и неповторяющиеся названия, а не числа
+    if not all(header) or len(set(header)) != width or any(_NUMBER_RE.match(name) for name in header):
+        return False
+    fields = [field for row in rows for field in row if field]
+    if sum(len(field.split()) for field in fields) > MAX_CSV_WORDS_PER_FIELD * len(fields):
+        return False
+    for column in range(width):
+        kinds = {bool(_NUMBER_RE.match(row[column])) for row in data if row[column]}
+        if len(kinds) > 1:
+            return False
+    return True
+
+
+def _collapse_whitespace(lines):
+    """Убирает пробелы в конце строк, повторы пробелов внутри строк и лишние пустые строки
+
+    Отступы в начале строк сохраняются (вложенные списки), код внутри ``` не меняется.
+    """
+    result = []
+    in_fence = False
+    blank = False
+    for line in lines:
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+            result.append(line.rstrip())
+            blank = False
+            continue
+        if in_fence:
+            result.append(line.rstrip())
+            continue
+        line = _INNER_SPACES_RE.sub(' ', line.rstrip())
+        if not line:
+            if blank or not result:
+                continue
+            blank = True
+        else:
+            blank = False
+        result.append(line)
+    return result
+
+
+def _dedupe(lines):
+    """Удаляет подряд идущие одинаковые строки и повторы длинных абзацев"""
+    blocks = []
+    block = []
+    in_fence = False
+    for line in lines:
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+        if not line and not in_fence:
+            if block:
+                blocks.append(block)
+            block = []
+            continue
+        # Повтор строки внутри кода может быть значимым
+        if not in_fence and block and line == block[-1] and not _FENCE_RE.match(line):
+            continue
+        block.append(line)
+    if block:
+        blocks.append(block)
+    seen = set()
+    result = []
+    for block in blocks:
+        text = "\n".join(block)
+        key = ' '.join(text.split())
+        if len(key) >= MIN_DUPLICATE_BLOCK_CHARS:
+            if key in seen:
+                continue
+            seen.add(key)
+        result.append(text)
+    return "\n\n".join(result)
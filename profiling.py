@@ -0,0 +1,230 @@
+"""Профилирование и поиск зависаний интерфейса
+
+Profiler включается флагом --profile: запуск и каждая оптимизация записываются
+через cProfile и tracemalloc в папку profiles конфига. Один сеанс может охватывать
+несколько потоков: каждый поток включает в сеансе свой профиль, а отчет
+пишется, когда свой профиль выключат все участники.
+
+StallWatchdog работает всегда: отслеживаемый цикл событий регулярно вызывает beat(),
+а фоновый поток замечает пропущенные удары, снимает стек зависшего потока и
+записывает зависания дольше порога в stalls.jsonl.
+"""
+import io
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import traceback
+import tracemalloc
+from collections import deque
+
+# Порог зависания цикла событий по умолчанию, в секундах
+STALL_THRESHOLD = 0.05
+# Сколько снимков стека хранится для одного зависания
+MAX_STACK_SAMPLES = 5
+# Сколько строк статистики попадает в текстовый отчет
+REPORT_LINES = 40
+# Кадров tracemalloc на выделение памяти: больше - точнее отчет, но дороже профилирование
+TRACEMALLOC_FRAMES = 10
+
+
+class ProfileSession:
+    """Сеанс профилирования: cProfile в каждом участвующем потоке и снимки tracemalloc"""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.started = time.time()
+        self._start_time = time.perf_counter()
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._active = 0
+        self._closed = False
+        self._reported = False
+        tracemalloc.reset_peak()
+        self._snapshot = tracemalloc.take_snapshot()
+        # Поток, открывший сеанс, профилируется до close()
+        self._own_profile = self.enable()
+
+    def enable(self):
+        """Включает профиль в текущем потоке; вернуть его нужно в disable() из того же потока"""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # В потоке уже работает другой профилировщик
+            profile = None
+        with self._lock:
+            if profile is not None:
+                self._profiles.append(profile)
+            self._active += 1
+        return profile
+
+    def disable(self, profile):
+        if profile is not None:
+            profile.disable()
+        self._release()
+
+    def close(self):
+        """Завершает сеанс в потоке, который его открыл"""
+        if self._closed:
+            return
+        self._closed = True
+        self._elapsed = time.perf_counter() - self._start_time
+        self.disable(self._own_profile)
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+            # Участник, подключившийся после отчета, в него уже не попадает
+            done = self._active == 0 and self._closed and not self._reported and bool(self._profiles)
+            if done:
+                self._reported = True
+        if done:
+            # Отчет пишется в фоне, чтобы не задерживать интерфейс
+            threading.Thread(target=self.profiler.write_report, args=(self,), daemon=True).start()
+
+
+class Profiler:
+    """Пишет отчеты сеансов в output_dir: .prof для snakeviz/pstats и текстовую сводку"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def start(self, name):
+        return ProfileSession(self, name)
+
+    def write_report(self, session):
+        try:
+            self._write_report(session)
+        except Exception as e:
+            print(f"Error writing profile: {e}", file=sys.stderr)
+
+    def _write_report(self, session):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(session.started))
+        base_path = os.path.join(self.output_dir, f"{session.name}-{stamp}-{int(session.started * 1000) % 1000:03d}")
+        _, peak = tracemalloc.get_traced_memory()
+        memory_diff = tracemalloc.take_snapshot().compare_to(session._snapshot, 'lineno')
+
+        report = io.StringIO()
+        stats = pstats.Stats(session._profiles[0], stream=report)
+        for profile in session._profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(base_path + '.prof')
+
+        report.write(f"{session.name}: {session._elapsed * 1000:.1f} ms, "
+                     f"threads: {len(session._profiles)}, peak traced memory: {peak / 1024 / 1024:.1f} MB\n\n")
+        stats.sort_stats('cumulative').print_stats(REPORT_LINES)
+        report.write("\nMemory allocated during the session (top lines):\n")
+        for stat in memory_diff[:REPORT_LINES]:
+            report.write(f"{stat}\n")
+        with open(base_path + '.txt', 'w', encoding='utf-8') as f:
+            f.write(report.getvalue())
+        print(f"Profile written to {base_path}.txt", file=sys.stderr)
+
+
+def sample_stack(thread_id):
+    """Стек потока в виде строк "файл:строка функция", от внешнего вызова к текущему"""
+    frame = sys._current_frames().get(thread_id)
+    if frame is None:
+        return []
+    return [f"{os.path.basename(entry.filename)}:{entry.lineno} {entry.name}"
+            for entry in traceback.extract_stack(frame)]
+
+
+class StallWatchdog:
+    """Находит зависания цикла событий дольше threshold секунд
+
+    beat() вызывается из отслеживаемого потока каждые interval секунд (например,
+    по QTimer). Фоновый поток проверяет, давно ли был последний удар, и во время
+    зависания снимает стек: для долгих вызовов C-кода, удерживающих GIL, снимок
+    получается сразу после них, но в той же функции Python. Длительность зависания
+    известна на следующем ударе, тогда же запись уходит в журнал.
+    """
+
+    def __init__(self, log_path, threshold=STALL_THRESHOLD, interval=None, max_log_bytes=5 * 1024 * 1024):
+        self.log_path = log_path
+        self.threshold = threshold
+        self.interval = interval if interval is not None else threshold / 2
+        self.max_log_bytes = max_log_bytes
+        self.stall_count = 0
+        self.recent = deque(maxlen=50)
+        self._thread_id = None
+        self._last_beat = None
+        self._samples = []
+        self._records = deque()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._monitor = None
+
+    def start(self):
+        """Запускает наблюдение за текущим потоком"""
+        self._thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._monitor = threading.Thread(target=self._run, name='stall-watchdog', daemon=True)
+        self._monitor.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._monitor is not None:
+            self._monitor.join(timeout=1.0)
+
+    def beat(self):
+        now = time.perf_counter()
+        gap = now - self._last_beat
+        self._last_beat = now
+        # Задержка сверх периода таймера - время, на которое цикл событий был занят
+        stall = gap - self.interval
+        if stall >= self.threshold:
+            samples, self._samples = self._samples, []
+            record = {'ts': time.time(), 'duration_ms': round(stall * 1000, 1), 'stacks': samples}
+            self.stall_count += 1
+            self.recent.append(record)
+            self._records.append(record)
+            self._wakeup.set()
+        elif self._samples:
+            self._samples = []
+
+    def _run(self):
+        check_interval = self.threshold / 2
+        last_check = time.perf_counter()
+        last_sample = 0.0
+        while not self._stopped.is_set():
+            self._wakeup.wait(check_interval)
+            self._wakeup.clear()
+            now = time.perf_counter()
+            if now - last_check > check_interval * 20:
+                # Сам монитор проспал: компьютер засыпал, это не зависание интерфейса
+                self._last_beat = now
+                self._samples = []
+            last_check = now
+            overdue = now - self._last_beat - self.interval
+            if overdue >= self.threshold and len(self._samples) < MAX_STACK_SAMPLES \
+                    and now - last_sample >= self.threshold:
+                self._samples.append(sample_stack(self._thread_id))
+                last_sample = now
+            if self._records:
+                self._flush()
+
+    def _flush(self):
+        records = []
+        while self._records:
+            records.append(self._records.popleft())
+        try:
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > self.max_log_bytes:
+                os.replace(self.log_path, self.log_path + '.1')
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"Error writing stall log: {e}", file=sys.stderr)
@@ -0,0 +1,188 @@
+"""Ограничение скорости запросов к API: квоты RPM/TPM, повторы с backoff и адаптивный параллелизм"""
+import re
+import time
+import random
+import asyncio
+
+# HTTP-коды, при которых запрос имеет смысл повторить
+THROTTLE_CODES = {429}
+TRANSIENT_CODES = {500, 502, 503, 504}
+
+_RETRY_IN_RE = re.compile(r'retry in ([\d.]+)\s*s', re.IGNORECASE)
+_RETRY_DELAY_RE = re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)', re.IGNORECASE)
+
+
+class TokenBucket:
+    """Корзина токенов с пополнением rate_per_minute в минуту
+
+    Крупный запрос может увести баланс в минус: он ждет только накопления
+    capacity, а долг затем отрабатывают следующие запросы. Так квота
+    соблюдается в среднем и для запросов больше емкости корзины.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        # Небольшая емкость сглаживает всплески: квота считается по скользящей минуте
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount=1):
+        """Ждет, пока в корзине наберется нужное количество, и списывает его"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Блокировка сохраняет очередность ожидающих запросов
+        async with self._lock:
+            needed = min(amount, self.capacity)
+            while True:
+                self._refill()
+                if self._tokens >= needed:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((needed - self._tokens) / self.rate)
+
+
+class RateLimiter:
+    """Лимиты запросов (RPM) и токенов (TPM) в минуту; None отключает лимит"""
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm, capacity=max(1.0, tpm / 6.0)) if tpm else None
+
+    async def acquire(self, tokens=0):
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None and tokens:
+            await self.tokens.acquire(tokens)
+
+
+class AdaptiveConcurrency:
+    """Семафор с изменяемым лимитом: сужается вдвое при троттлинге и растет на единицу после серии успехов"""
+
+    def __init__(self, limit, minimum=1, maximum=None, increase_after=5, cooldown=1.0):
+        self.maximum = maximum or limit
+        self.minimum = minimum
+        self.limit = max(minimum, min(limit, self.maximum))
+        self.increase_after = increase_after
+        self.cooldown = cooldown
+        self._active = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._condition = None
+
+    def _get_condition(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def __aenter__(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        condition = self._get_condition()
+        async with condition:
+            self._active -= 1
+            condition.notify_all()
+        return False
+
+    async def on_success(self):
+        self._successes += 1
+        if self._successes < self.increase_after or self.limit >= self.maximum:
+            return
+        condition = self._get_condition()
+        async with condition:
+            if self._successes >= self.increase_after and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                # Ожидающие под прежним лимитом занимают новый слот сразу, а не после чужого освобождения
+                condition.notify_all()
+
+    def on_throttle(self):
+        # Одновременные ошибки 429 от уже запущенных запросов уменьшают лимит только один раз
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self._successes = 0
+        self.limit = max(self.minimum, self.limit // 2)
+
+
+# Статусы gRPC, соответствующие повторяемым HTTP-кодам
+_GRPC_STATUS_CODES = {
+    'RESOURCE_EXHAUSTED': 429,
+    'INTERNAL': 500,
+    'UNAVAILABLE': 503,
+    'DEADLINE_EXCEEDED': 504,
+}
+
+
+def _error_code(error):
+    """HTTP-статус ошибки: из google.api_core, gRPC или текста сообщения"""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code
+    if callable(code):
+        # grpc.RpcError.code() возвращает StatusCode
+        try:
+            status = code()
+        except Exception:
+            status = None
+        name = getattr(status, 'name', None)
+        if name in _GRPC_STATUS_CODES:
+            return _GRPC_STATUS_CODES[name]
+    match = re.match(r'\s*(\d{3})\b', str(error))
+    return int(match.group(1)) if match else None
+
+
+def classify_error(error):
+    """'throttle' для превышения квоты, 'transient' для временных сбоев, иначе None"""
+    code = _error_code(error)
+    if code in THROTTLE_CODES or type(error).__name__ in ('ResourceExhausted', 'TooManyRequests'):
+        return 'throttle'
+    if code in TRANSIENT_CODES or isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return 'transient'
+    if type(error).__name__ in ('ServiceUnavailable', 'InternalServerError', 'DeadlineExceeded',
+                                'GatewayTimeout', 'BadGateway'):
+        return 'transient'
+    return None
+
+
+def retry_after(error):
+    """Пауза в секундах, подсказанная сервером, или None"""
+    details = getattr(error, 'details', None)
+    if not isinstance(details, (list, tuple)):
+        details = []
+    for detail in details:
+        delay = getattr(detail, 'retry_delay', None)
+        if delay is not None and hasattr(delay, 'seconds'):
+            return delay.seconds + getattr(delay, 'nanos', 0) / 1e9
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers is not None:
+        value = headers.get('Retry-After')
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    text = str(error)
+    match = _RETRY_IN_RE.search(text) or _RETRY_DELAY_RE.search(text)
+    return float(match.group(1)) if match else None
+
+
+def backoff_delay(attempt, base=1.0, max_delay=60.0, hint=None):
+    """Экспоненциальная задержка со случайным разбросом; подсказка сервера - нижняя граница"""
+    delay = min(max_delay, base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+    if hint is not None:
+        delay = max(delay, hint)
+    return delay
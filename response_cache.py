@@ -0,0 +1,103 @@
+"""Кэш ответов модели на диске с адресацией по содержимому запроса"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """LRU-кэш ответов: один файл на запрос, ограничение по числу записей, объему и сроку жизни"""
+
+    def __init__(self, cache_dir, max_entries=500, max_bytes=50 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._index = None  # OrderedDict ключ -> размер файла, от старых к новым
+        self._total_bytes = 0
+
+    @staticmethod
+    def make_key(prompt, model_name, template, generation_config):
+        """Ключ кэша: хэш промпта, модели, шаблона и параметров генерации"""
+        payload = json.dumps({
+            'prompt': prompt,
+            'model': model_name,
+            'template': template,
+            'generation_config': generation_config,
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_index(self):
+        """Строит индекс по файлам кэша при первом обращении"""
+        if self._index is not None:
+            return
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            # Время изменения файла обновляется при каждом попадании и служит меткой LRU
+            entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        entries.sort()
+        self._index = OrderedDict((key, size) for _, key, size in entries)
+        self._total_bytes = sum(self._index.values())
+
+    def _remove(self, key):
+        size = self._index.pop(key, 0)
+        self._total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def get(self, key):
+        """Возвращает сохраненный ответ или None, если его нет или срок истек"""
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                return None
+            path = self._path(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self._remove(key)
+                return None
+            if time.time() - entry.get('created', 0) > self.ttl:
+                self._remove(key)
+                return None
+            self._index.move_to_end(key)
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return entry.get('text')
+
+    def put(self, key, text):
+        """Сохраняет ответ и вытесняет самые давние записи сверх лимитов"""
+        data = json.dumps({'created': time.time(), 'text': text}, ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            self._load_index()
+            path = self._path(key)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._total_bytes += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            while self._index and (len(self._index) > self.max_entries or self._total_bytes > self.max_bytes):
+                oldest = next(iter(self._index))
+                if oldest == key:
+                    break
+                self._remove(oldest)
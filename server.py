@@ -0,0 +1,390 @@
+"""Локальный HTTP-сервер: улучшение промптов для других программ без графического интерфейса
+
+Запуск:
+    python prompt_improver.py serve [--host 127.0.0.1] [--port 8765] [--queue-size 64]
+
+Эндпоинты:
+    POST /improve          {"prompt": "..."} -> {"result": "...", "from_cache": ..., ...}
+    POST /improve/stream   тот же запрос, ответ - поток Server-Sent Events (chunk, done, error)
+    POST /batch            {"prompts": ["...", ...]} -> {"results": [{"result": ...} | {"error": ...}]}
+    GET  /metrics          метрики в текстовом формате Prometheus
+    GET  /health           состояние очереди
+
+Все запросы обслуживает один оптимизатор: общий клиент Gemini, кэш, квоты и
+адаптивный параллелизм. Соединения поддерживают keep-alive. Если в работе уже
+queue_size промптов, новые запросы сразу получают 503 с заголовком Retry-After.
+"""
+import sys
+import json
+import asyncio
+import argparse
+from http import HTTPStatus
+
+from optimizer_core import clean_response
+from batch import add_optimizer_arguments, create_optimizer
+
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE_SIZE = 64
+MAX_BODY_BYTES = 32 * 1024 * 1024
+# Сколько простаивающее keep-alive соединение ждет первой строки следующего запроса
+KEEPALIVE_TIMEOUT = 15.0
+# Заголовки должны прийти целиком за это время после первой строки
+HEADER_TIMEOUT = 10.0
+# Тело читается частями: медленная загрузка большого промпта не обрывается, пока данные идут,
+# а соединение закрывается, если между частями проходит дольше BODY_TIMEOUT
+BODY_TIMEOUT = 30.0
+BODY_CHUNK_BYTES = 64 * 1024
+MAX_HEADERS = 100
+# Подсказка клиенту при переполнении очереди, в секундах
+RETRY_AFTER = 1
+
+
+class HTTPError(Exception):
+    """Ошибка запроса, которая отдается клиенту с кодом status"""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class OptimizerServer:
+    """HTTP/1.1-сервер поверх asyncio для одного общего PromptOptimizer"""
+
+    def __init__(self, optimizer, queue_size=DEFAULT_QUEUE_SIZE, use_cache=True, split_long=False,
+                 max_body_bytes=MAX_BODY_BYTES, keepalive_timeout=KEEPALIVE_TIMEOUT,
+                 header_timeout=HEADER_TIMEOUT, body_timeout=BODY_TIMEOUT):
+        self.optimizer = optimizer
+        self.queue_size = queue_size
+        self.use_cache = use_cache
+        self.split_long = split_long
+        self.max_body_bytes = max_body_bytes
+        self.keepalive_timeout = keepalive_timeout
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.pending = 0
+        self.rejected_count = 0
+        self._routes = {
+            '/improve': ('POST', self._handle_improve),
+            '/improve/stream': ('POST', self._handle_improve_stream),
+            '/batch': ('POST', self._handle_batch),
+            '/metrics': ('GET', self._handle_metrics),
+            '/health': ('GET', self._handle_health),
+        }
+
+    async def start(self, host='127.0.0.1', port=DEFAULT_PORT):
+        """Открывает сокет и возвращает asyncio.Server"""
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except asyncio.TimeoutError:
+                    # Простаивающее keep-alive соединение закрывается молча
+                    break
+                except HTTPError as e:
+                    # После ошибки разбора граница следующего запроса неизвестна
+                    await self._send_json(writer, e.status, {'error': e.message}, False, e.headers)
+                    break
+                if request is None:
+                    break
+                method, path, keep_alive, body = request
+                try:
+                    await self._dispatch(method, path, body, writer, keep_alive)
+                except HTTPError as e:
+                    await self._send_json(writer, e.status, {'error': e.message}, keep_alive, e.headers)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request(self, reader):
+        """Читает запрос: (метод, путь, keep-alive, тело) или None, если клиент закрыл соединение"""
+        # Таймаут простоя keep-alive - только до первой строки: дальше действуют свои таймауты
+        line = await asyncio.wait_for(reader.readline(), self.keepalive_timeout)
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        try:
+            headers = await asyncio.wait_for(self._read_headers(reader), self.header_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(408, "Timed out reading request headers")
+        if 'transfer-encoding' in headers:
+            raise HTTPError(501, "Chunked request bodies are not supported")
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > self.max_body_bytes:
+            raise HTTPError(413, "Request body too large")
+        body = await self._read_body(reader, length) if length else b''
+        connection = headers.get('connection', '').lower()
+        # HTTP/1.1 держит соединение по умолчанию, HTTP/1.0 - только по явной просьбе
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        return method.upper(), target.split('?', 1)[0], keep_alive, body
+
+    async def _read_headers(self, reader):
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                return headers
+            if len(headers) >= MAX_HEADERS:
+                raise HTTPError(431, "Too many headers")
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    async def _read_body(self, reader, length):
+        """Тело запроса длиной length; таймаут - на паузу между частями, а не на всю загрузку"""
+        parts = []
+        remaining = length
+        while remaining:
+            try:
+                part = await asyncio.wait_for(reader.read(min(remaining, BODY_CHUNK_BYTES)), self.body_timeout)
+            except asyncio.TimeoutError:
+                raise HTTPError(408, "Timed out reading request body")
+            if not part:
+                raise asyncio.IncompleteReadError(b''.join(parts), length)
+            parts.append(part)
+            remaining -= len(part)
+        return b''.join(parts)
+
+    async def _dispatch(self, method, path, body, writer, keep_alive):
+        route = self._routes.get(path)
+        if route is None:
+            raise HTTPError(404, f"Unknown path: {path}")
+        allowed, handler = route
+        if method != allowed:
+            raise HTTPError(405, f"Use {allowed} for {path}", {'Allow': allowed})
+        await handler(body, writer, keep_alive)
+
+    def _reserve(self, count):
+        """Занимает count мест в очереди или отклоняет запрос с 503"""
+        if count > self.queue_size:
+            raise HTTPError(413, f"Batch larger than the queue size ({self.queue_size})")
+        if self.pending + count > self.queue_size:
+            self.rejected_count += 1
+            raise HTTPError(503, "Server is busy, retry later", {'Retry-After': str(RETRY_AFTER)})
+        self.pending += count
+
+    def _release(self, count):
+        self.pending -= count
+
+    def _parse_payload(self, body):
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            raise HTTPError(400, "Body must be JSON")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "Body must be a JSON object")
+        return payload
+
+    def _parse_prompt(self, body):
+        payload = self._parse_payload(body)
+        prompt = payload.get('prompt')
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise HTTPError(400, 'Field "prompt" must be a non-empty string')
+        return prompt.strip(), payload
+
+    def _options(self, payload):
+        return {
+            'use_cache': bool(payload.get('use_cache', self.use_cache)),
+            'split_long': bool(payload.get('split_long', self.split_long)),
+        }
+
+    async def _handle_improve(self, body, writer, keep_alive):
+        prompt, payload = self._parse_prompt(body)
+        self._reserve(1)
+        try:
+            result = await self.optimizer.improve(prompt, **self._options(payload))
+        except Exception as e:
+            raise HTTPError(502, str(e))
+        finally:
+            self._release(1)
+        await self._send_json(writer, 200, _result_payload(result), keep_alive)
+
+    async def _handle_improve_stream(self, body, writer, keep_alive):
+        prompt, payload = self._parse_prompt(body)
+        self._reserve(1)
+        try:
+            await self._send_head(writer, 200, 'text/event-stream; charset=utf-8', keep_alive, {
+                'Cache-Control': 'no-cache',
+                'Transfer-Encoding': 'chunked',
+            })
+            chunks = asyncio.Queue()
+            task = asyncio.ensure_future(self.optimizer.improve(
+                prompt, stream=True, on_chunk=chunks.put_nowait, **self._options(payload)
+            ))
+            try:
+                while True:
+                    getter = asyncio.ensure_future(chunks.get())
+                    done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                    if getter not in done:
+                        getter.cancel()
+                        break
+                    await self._send_event(writer, 'chunk', {'text': getter.result()})
+                while not chunks.empty():
+                    await self._send_event(writer, 'chunk', {'text': chunks.get_nowait()})
+                try:
+                    result = task.result()
+                except Exception as e:
+                    await self._send_event(writer, 'error', {'error': str(e)})
+                else:
+                    await self._send_event(writer, 'done', _result_payload(result))
+            finally:
+                # Клиент отключился посреди потока - запрос к API больше не нужен
+                task.cancel()
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        finally:
+            self._release(1)
+
+    async def _handle_batch(self, body, writer, keep_alive):
+        payload = self._parse_payload(body)
+        prompts = payload.get('prompts')
+        if not isinstance(prompts, list) or not all(isinstance(prompt, str) for prompt in prompts):
+            raise HTTPError(400, 'Field "prompts" must be a list of strings')
+        concurrency = payload.get('concurrency')
+        if concurrency is not None and (not isinstance(concurrency, int) or concurrency < 1):
+            raise HTTPError(400, 'Field "concurrency" must be a positive integer')
+        self._reserve(len(prompts))
+        try:
+            results = [None] * len(prompts)
+            async for index, result in self.optimizer.iter_improve(
+                    [prompt.strip() for prompt in prompts], concurrency=concurrency, ordered=True,
+                    **self._options(payload)):
+                if isinstance(result, Exception):
+                    results[index] = {'error': str(result)}
+                else:
+                    results[index] = _result_payload(result)
+        finally:
+            self._release(len(prompts))
+        await self._send_json(writer, 200, {'results': results}, keep_alive)
+
+    async def _handle_metrics(self, body, writer, keep_alive):
+        metrics = self.optimizer.metrics
+        text = metrics.prometheus_text() if metrics is not None else ''
+        text += '\n'.join([
+            '# HELP prompt_optimizer_server_pending Prompts accepted by the HTTP server and not finished yet.',
+            '# TYPE prompt_optimizer_server_pending gauge',
+            f'prompt_optimizer_server_pending {self.pending}',
+            '# HELP prompt_optimizer_server_queue_size Maximum number of pending prompts.',
+            '# TYPE prompt_optimizer_server_queue_size gauge',
+            f'prompt_optimizer_server_queue_size {self.queue_size}',
+            '# HELP prompt_optimizer_server_rejected_total Requests rejected with 503 because the queue was full.',
+            '# TYPE prompt_optimizer_server_rejected_total counter',
+            f'prompt_optimizer_server_rejected_total {self.rejected_count}',
+        ]) + '\n'
+        await self._send(writer, 200, text.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8', keep_alive)
+
+    async def _handle_health(self, body, writer, keep_alive):
+        await self._send_json(writer, 200, {'status': 'ok', 'pending': self.pending,
+                                            'queue_size': self.queue_size}, keep_alive)
+
+    def _head(self, status, content_type, keep_alive, headers):
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Type: {content_type}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        if keep_alive:
+            lines.append("Connection: keep-alive")
+            lines.append(f"Keep-Alive: timeout={int(self.keepalive_timeout)}")
+        else:
+            lines.append("Connection: close")
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def _send_head(self, writer, status, content_type, keep_alive, headers):
+        writer.write(self._head(status, content_type, keep_alive, headers))
+        await writer.drain()
+
+    async def _send(self, writer, status, body, content_type, keep_alive, headers=None):
+        headers = dict(headers or {})
+        headers['Content-Length'] = str(len(body))
+        writer.write(self._head(status, content_type, keep_alive, headers) + body)
+        await writer.drain()
+
+    async def _send_json(self, writer, status, payload, keep_alive, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        await self._send(writer, status, body, 'application/json; charset=utf-8', keep_alive, headers)
+
+    async def _send_event(self, writer, event, payload):
+        """Одно событие SSE в отдельном фрагменте chunked-ответа"""
+        data = f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8')
+        writer.write(f"{len(data):x}\r\n".encode('latin-1') + data + b'\r\n')
+        await writer.drain()
+
+
+def _result_payload(result):
+    return {
+        'result': clean_response(result.text),
+        'from_cache': result.from_cache,
+        'first_token_time': result.first_token_time,
+        'total_time': result.total_time,
+        'prompt_tokens': result.prompt_tokens,
+        'output_tokens': result.output_tokens,
+        'tokens_saved': result.tokens_saved,
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog='prompt_improver.py serve',
+        description='Локальный HTTP-сервер для улучшения промптов'
+    )
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Адрес для прослушивания (по умолчанию 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'Порт (по умолчанию {DEFAULT_PORT})')
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f'Сколько промптов может ждать и выполняться одновременно, '
+                             f'остальным - 503 (по умолчанию {DEFAULT_QUEUE_SIZE})')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Число одновременных запросов к API (по умолчанию 8)')
+    parser.add_argument('--split-long', action='store_true',
+                        help='Улучшать очень длинные промпты по разделам параллельно')
+    add_optimizer_arguments(parser)
+    return parser.parse_args(argv)
+
+
+async def serve(server, host, port):
+    # Соединение с API открывается до первого клиента и не остывает между запросами
+    await server.optimizer.warm_up()
+    keepalive = asyncio.ensure_future(server.optimizer.keep_alive())
+    listener = await server.start(host, port)
+    print(f"Serving on http://{host}:{port}", file=sys.stderr)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        keepalive.cancel()
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    optimizer, history = create_optimizer(args)
+    if optimizer is None:
+        return 2
+    server = OptimizerServer(optimizer, queue_size=args.queue_size, use_cache=not args.no_cache,
+                             split_long=args.split_long)
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if history is not None:
+            history.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""Реестр шаблонов запросов: неизменные правила отдельно от промпта пользователя
+
+Правила шаблона передаются модели как system_instruction один раз на модель,
+а в тексте каждого запроса остается только промпт с короткой подписью.
+Шаблоны версионируются по сценариям: get_template('improve') возвращает
+последнюю версию, get_template('improve@1') - конкретную. Свои шаблоны
+регистрируются через register_template или загружаются из JSON-файлов.
+"""
+import sys
+import os
+import re
+import json
+import hashlib
+
+from optimizer_core import (IMPROVEMENT_RULES, IMPROVEMENT_RULES_EN, DATA_MARKERS_RULE, DATA_MARKERS_RULE_EN,
+                            SECTION_RULE, SECTION_RULE_EN, BASELINE_RULE, BASELINE_RULE_EN)
+
+_FIELD_RE = re.compile(r'\{(\w+)\}')
+
+
+class PromptTemplate:
+    """Шаблон: системная инструкция и текст запроса с полями вида {prompt}"""
+
+    def __init__(self, name, version, system_instruction, user_template='{prompt}', description=''):
+        self.name = name
+        self.version = int(version)
+        self.system_instruction = system_instruction
+        self.user_template = user_template
+        self.description = description
+        # Отпечаток содержимого входит в ключ кэша: правка шаблона без смены версии не отдаст старые ответы
+        self.fingerprint = hashlib.sha256(
+            f"{system_instruction}\0{user_template}".encode('utf-8')
+        ).hexdigest()[:16]
+
+    @property
+    def key(self):
+        return f"{self.name}@{self.version}"
+
+    def render(self, prompt, **fields):
+        """Текст запроса; подстановка за один проход, поэтому скобки в самих значениях не трогаются"""
+        values = dict(fields, prompt=prompt)
+        return _FIELD_RE.sub(lambda match: str(values.get(match.group(1), match.group(0))), self.user_template)
+
+    def __repr__(self):
+        return f"PromptTemplate({self.key!r})"
+
+
+_REGISTRY = {}
+
+
+def register_template(template):
+    """Добавляет шаблон в реестр; та же версия заменяет прежнюю"""
+    _REGISTRY.setdefault(template.name, {})[template.version] = template
+    return template
+
+
+def get_template(spec):
+    """Шаблон по имени ('improve'), имени с версией ('improve@2') или сам PromptTemplate"""
+    if isinstance(spec, PromptTemplate):
+        return spec
+    name, _, version = spec.partition('@')
+    versions = _REGISTRY.get(name)
+    if not versions:
+        raise ValueError(f"Unknown template: {spec}")
+    if not version:
+        return versions[max(versions)]
+    try:
+        return versions[int(version)]
+    except (KeyError, ValueError):
+        raise ValueError(f"Unknown template version: {spec}")
+
+
+def template_for_language(template, language):
+    """Вариант шаблона той же версии для языка промпта ('имя-en@версия'), если он есть, иначе сам шаблон"""
+    if language:
+        variant = _REGISTRY.get(f"{template.name}-{language}", {}).get(template.version)
+        if variant is not None:
+            return variant
+    return template
+
+
+def scenario_template(template, scenario):
+    """Шаблон сценария ('section', 'segment', 'baseline') для основного шаблона той же версии
+
+    Имя берется из основного: 'improve' -> 'section', 'improve-en' -> 'section-en', свой 'name' -> 'name-section'.
+    Правила шаблона сценария должны начинаться с правил основного, иначе разделы и похожие промпты
+    улучшались бы по другим правилам; без подходящего шаблона - ValueError.
+    """
+    if template.name == 'improve' or template.name.startswith('improve-'):
+        name = scenario + template.name[len('improve'):]
+    else:
+        name = f"{template.name}-{scenario}"
+    variant = _REGISTRY.get(name, {}).get(template.version)
+    if variant is None:
+        raise ValueError(f"Template {template.key} has no '{scenario}' template: register {name}@{template.version}")
+    if not variant.system_instruction.startswith(template.system_instruction):
+        raise ValueError(f"Template {variant.key} does not extend the rules of {template.key}")
+    return variant
+
+
+def list_templates():
+    """Все зарегистрированные шаблоны, по имени и версии"""
+    return [versions[version] for name, versions in sorted(_REGISTRY.items()) for version in sorted(versions)]
+
+
+def load_templates(directory):
+    """Регистрирует шаблоны из *.json в папке и возвращает их число
+
+    Файл: {"name": ..., "version": 1, "system_instruction": ..., "user_template": "...{prompt}..."}
+    Шаблоны сценариев для своего шаблона - отдельными файлами, см. scenario_template.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    count = 0
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, file_name), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            register_template(PromptTemplate(
+                data['name'], data.get('version', 1), data['system_instruction'],
+                data.get('user_template', '{prompt}'), data.get('description', '')
+            ))
+            count += 1
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Error loading template {file_name}: {e}", file=sys.stderr)
+    return count
+
+
+_RULE_NUMBER_RE = re.compile(r'^\d+\.', re.M)
+
+
+def with_rules(rules, *extra):
+    """Общий список правил и дополнительные правила под следующими номерами"""
+    count = len(_RULE_NUMBER_RE.findall(rules))
+    return "\n".join([rules] + [f"{count + offset}. {rule}" for offset, rule in enumerate(extra, 1)])
+
+
+# Встроенные шаблоны: общий набор правил и подписи для разных сценариев.
+# Версия 1 - исходные правила; версия 2 добавляет правило о метках вынесенных данных (preprocess).
+# Содержимое зарегистрированной версии не меняется: новые формулировки - только новой версией
+IMPROVE_RULES_V2 = with_rules(IMPROVEMENT_RULES, DATA_MARKERS_RULE)
+IMPROVE_RULES_EN_V2 = with_rules(IMPROVEMENT_RULES_EN, DATA_MARKERS_RULE_EN)
+
+IMPROVE_V1 = register_template(PromptTemplate(
+    'improve', 1, IMPROVEMENT_RULES,
+    "ИСХОДНЫЙ ПРОМПТ:\n{prompt}",
+    "Улучшение промпта целиком"
+))
+SECTION_V1 = register_template(PromptTemplate(
+    'section', 1, with_rules(IMPROVEMENT_RULES, SECTION_RULE),
+    # Номер фрагмента - в тексте запроса, чтобы инструкция была общей для всех фрагментов
+    "Фрагмент {index} из {total}.\n\nФРАГМЕНТ ПРОМПТА:\n{prompt}",
+    "Раздел длинного промпта"
+))
+SEGMENT_V1 = register_template(PromptTemplate(
+    'segment', 1, with_rules(IMPROVEMENT_RULES, SECTION_RULE),
+    # Без номера: вставка нового сегмента не меняет запросы остальных
+    "ФРАГМЕНТ ПРОМПТА:\n{prompt}",
+    "Сегмент в инкрементальном режиме"
+))
+BASELINE_V1 = register_template(PromptTemplate(
+    'baseline', 1, with_rules(IMPROVEMENT_RULES, BASELINE_RULE),
+    "ПОХОЖИЙ ПРОМПТ:\n{similar_prompt}\n\nЕГО УЛУЧШЕННАЯ ВЕРСИЯ:\n{similar_result}\n\nИСХОДНЫЙ ПРОМПТ:\n{prompt}",
+    "Улучшение на основе результата похожего промпта"
+))
+
+IMPROVE = register_template(PromptTemplate(
+    'improve', 2, IMPROVE_RULES_V2, IMPROVE_V1.user_template, IMPROVE_V1.description
+))
+SECTION = register_template(PromptTemplate(
+    'section', 2, with_rules(IMPROVE_RULES_V2, SECTION_RULE), SECTION_V1.user_template, SECTION_V1.description
+))
+SEGMENT = register_template(PromptTemplate(
+    'segment', 2, with_rules(IMPROVE_RULES_V2, SECTION_RULE), SEGMENT_V1.user_template, SEGMENT_V1.description
+))
+BASELINE = register_template(PromptTemplate(
+    'baseline', 2, with_rules(IMPROVE_RULES_V2, BASELINE_RULE), BASELINE_V1.user_template, BASELINE_V1.description
+))
+
+# Англоязычные варианты версии 2: template_for_language подставляет их вместо шаблонов той же версии
+IMPROVE_EN = register_template(PromptTemplate(
+    'improve-en', 2, IMPROVE_RULES_EN_V2,
+    "ORIGINAL PROMPT:\n{prompt}",
+    "Улучшение англоязычного промпта"
+))
+SECTION_EN = register_template(PromptTemplate(
+    'section-en', 2, with_rules(IMPROVE_RULES_EN_V2, SECTION_RULE_EN),
+    "Fragment {index} of {total}.\n\nPROMPT FRAGMENT:\n{prompt}",
+    "Раздел длинного англоязычного промпта"
+))
+SEGMENT_EN = register_template(PromptTemplate(
+    'segment-en', 2, with_rules(IMPROVE_RULES_EN_V2, SECTION_RULE_EN),
+    "PROMPT FRAGMENT:\n{prompt}",
+    "Сегмент англоязычного промпта в инкрементальном режиме"
+))
+BASELINE_EN = register_template(PromptTemplate(
+    'baseline-en', 2, with_rules(IMPROVE_RULES_EN_V2, BASELINE_RULE_EN),
+    "SIMILAR PROMPT:\n{similar_prompt}\n\nITS IMPROVED VERSION:\n{similar_result}\n\nORIGINAL PROMPT:\n{prompt}",
+    "Улучшение англоязычного промпта на основе результата похожего"
+))
@@ -0,0 +1,45 @@
+import asyncio
+import sqlite3
+
+from backends import StubBackend
+from history import HistoryStore
+from optimizer_engine import PromptOptimizer
+
+PROMPT = "Напиши подробный план статьи о выращивании томатов в теплице для начинающих садоводов"
+
+
+def create_optimizer(history, template):
+    backend = StubBackend(latency_median=0.0, first_token_median=0.0, chunk_interval=0.0, seed=1)
+    return PromptOptimizer(backend=backend, history=history, template=template, similar_threshold=0.5)
+
+
+def test_similar_prompts_are_not_shared_between_templates(tmp_path):
+    history = HistoryStore(str(tmp_path / 'history.db'))
+    pinned = create_optimizer(history, 'improve@1')
+    latest = create_optimizer(history, 'improve@2')
+    asyncio.run(pinned.improve(PROMPT))
+
+    result = asyncio.run(latest.improve(PROMPT + " и огородников"))
+    assert not result.from_cache
+    assert latest.backend.request_count == 1
+
+    result = asyncio.run(pinned.improve(PROMPT + " и огородников"))
+    assert result.from_cache and result.similarity is not None
+    assert pinned.backend.request_count == 1
+
+
+def test_old_database_gets_template_column(tmp_path):
+    db_path = str(tmp_path / 'history.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE history (id INTEGER PRIMARY KEY, created REAL NOT NULL, prompt TEXT NOT NULL, '
+                 'result TEXT NOT NULL, model TEXT, generation_config TEXT, request_key TEXT, '
+                 'first_token_time REAL, total_time REAL, prompt_tokens INTEGER, output_tokens INTEGER)')
+    conn.execute("INSERT INTO history (created, prompt, result) VALUES (0, ?, 'old')", (PROMPT,))
+    conn.commit()
+    conn.close()
+
+    history = HistoryStore(db_path)
+    assert history.get(1)['template'] is None
+    entry_id = history.add(PROMPT, 'new', template='improve@2:0')
+    assert history.get(entry_id)['template'] == 'improve@2:0'
+    assert history.find_similar(PROMPT, 0.5, template='improve@1:0') is None
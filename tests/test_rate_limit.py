@@ -0,0 +1,28 @@
+import asyncio
+
+from rate_limit import AdaptiveConcurrency
+
+
+def test_raised_limit_wakes_waiters():
+    async def scenario():
+        limiter = AdaptiveConcurrency(1, maximum=2, increase_after=1)
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter:
+                await release.wait()
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(limiter.__aenter__())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        await limiter.on_success()
+        # Ожидающий входит сразу после увеличения лимита, пока holder еще держит свой слот
+        await asyncio.wait_for(waiter, 1.0)
+        assert limiter.limit == 2 and not holder.done()
+        release.set()
+        await holder
+        await limiter.__aexit__(None, None, None)
+
+    asyncio.run(scenario())
@@ -0,0 +1,31 @@
+import asyncio
+
+from backends import StubBackend
+from optimizer_core import split_prompt_sections, strip_sections
+from optimizer_engine import PromptOptimizer
+
+
+class EchoBackend(StubBackend):
+    """Заглушка, возвращающая фрагмент без изменений"""
+
+    def __init__(self):
+        super().__init__(latency_median=0.0, first_token_median=0.0, chunk_interval=0.0, seed=1)
+
+    def respond(self, prompt):
+        return prompt.rpartition("ФРАГМЕНТ ПРОМПТА:\n")[2]
+
+
+def test_strip_sections_keeps_source_separators():
+    pieces = ["1. Первый\n", "2. Второй\n\n", "   ", "Абзац\n", "    код"]
+    assert strip_sections(pieces) == [('', "1. Первый"), ("\n", "2. Второй"), ("\n\n   ", "Абзац"), ("\n    ", "код")]
+
+
+def test_sections_keep_line_breaks():
+    items = [f"{index}. Пункт списка номер {index}, который описывает одно правило ответа" for index in range(1, 400)]
+    prompt = "\n".join(items)
+    assert len(split_prompt_sections(prompt)) > 1
+    chunks = []
+    optimizer = PromptOptimizer(backend=EchoBackend(), split_long=True)
+    result = asyncio.run(optimizer.improve(prompt, stream=True, on_chunk=chunks.append))
+    assert result.text == prompt
+    assert ''.join(chunks) == prompt
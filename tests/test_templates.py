@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from backends import StubBackend
+from history import HistoryStore
+from optimizer_engine import PromptOptimizer
+from templates import PromptTemplate, get_template, register_template, scenario_template
+
+
+class RecordingBackend(StubBackend):
+    """Заглушка, запоминающая системную инструкцию каждого запроса"""
+
+    def __init__(self):
+        super().__init__(latency_median=0.0, first_token_median=0.0, chunk_interval=0.0, seed=1)
+        self.instructions = []
+
+    async def generate(self, prompt, generation_config, on_chunk=None, system_instruction=None):
+        self.instructions.append(system_instruction)
+        return await super().generate(prompt, generation_config, on_chunk, system_instruction)
+
+
+def long_prompt():
+    blocks = [f"## Раздел {index}\n" + "Отвечай кратко и по делу, с примерами. " * 60 for index in range(12)]
+    return "\n\n".join(blocks)
+
+
+def test_pinned_version_sections():
+    backend = RecordingBackend()
+    optimizer = PromptOptimizer(backend=backend, template='improve@1', split_long=True)
+    asyncio.run(optimizer.improve(long_prompt()))
+    assert len(backend.instructions) > 1
+    assert set(backend.instructions) == {get_template('section@1').system_instruction}
+
+
+def test_pinned_version_baseline(tmp_path):
+    backend = RecordingBackend()
+    history = HistoryStore(str(tmp_path / 'history.db'))
+    optimizer = PromptOptimizer(backend=backend, template='improve@1', history=history,
+                                similar_threshold=0.5, similar_mode='baseline')
+    prompt = "Напиши подробный план статьи о выращивании томатов в теплице для начинающих садоводов"
+    asyncio.run(optimizer.improve(prompt))
+    asyncio.run(optimizer.improve(prompt + " и огородников"))
+    assert backend.instructions == [get_template('improve@1').system_instruction,
+                                    get_template('baseline@1').system_instruction]
+
+
+def test_pinned_version_segments():
+    backend = RecordingBackend()
+    optimizer = PromptOptimizer(backend=backend, template='improve@1')
+    asyncio.run(optimizer.improve_incremental(long_prompt()))
+    assert len(backend.instructions) > 1
+    assert set(backend.instructions) == {get_template('segment@1').system_instruction}
+
+
+def test_custom_template_without_scenario_fails():
+    custom = register_template(PromptTemplate('custom-rules', 1, "1. Будь краток"))
+    optimizer = PromptOptimizer(backend=RecordingBackend(), template=custom, split_long=True)
+    with pytest.raises(ValueError, match='custom-rules-section@1'):
+        asyncio.run(optimizer.improve(long_prompt()))
+
+
+def test_scenario_must_extend_rules():
+    custom = PromptTemplate('improve', 1, "1. Другие правила")
+    with pytest.raises(ValueError, match='does not extend'):
+        scenario_template(custom, 'section')